@@ -12,8 +12,6 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 import os
 from pathlib import Path
 
-from import_export.formats.base_formats import XLSX, DEFAULT_FORMATS
-
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -52,11 +50,13 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
+    'vote.routers.PrimaryPinningMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'vote.profiling.SamplingProfilerMiddleware',
 ]
 
 ROOT_URLCONF = 'bmcsdl.urls'
@@ -95,8 +95,85 @@ DATABASES = {
             'driver': 'ODBC Driver 17 for SQL Server',
         },
     },
+    # Read replica, e.g. two local SQLite files for testing the router:
+    # 'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': BASE_DIR / 'primary.sqlite3'},
+    # 'replica': {
+    #     'ENGINE': 'django.db.backends.sqlite3',
+    #     'NAME': BASE_DIR / 'replica.sqlite3',
+    #     'TEST': {'MIRROR': 'default'},
+    # },
 }
 
+DATABASE_ROUTERS = ['vote.routers.ShardRouter', 'vote.routers.ReplicaRouter']
+
+# District sharding: District id -> DATABASES alias holding that district's users, candidates and votes.
+# Unlisted districts stay on DISTRICT_SHARD_DEFAULT; an empty mapping disables sharding. With
+# SQLite files 'shard1' and 'shard2' added to DATABASES, e.g. {1: 'default', 2: 'shard1', 3: 'shard2'}
+DISTRICT_SHARDS = {}
+DISTRICT_SHARD_DEFAULT = 'default'
+
+# Aliases from DATABASES that serve read-only queries
+DATABASE_REPLICAS = []
+# Replicas lagging more than this many seconds are skipped until the next check
+DATABASE_REPLICA_MAX_LAG = 5
+# Query returning the replica lag in seconds; None only checks that the replica is reachable, e.g.
+# "SELECT DATEDIFF(SECOND, MAX(last_commit_time), SYSDATETIME()) FROM sys.dm_hadr_database_replica_states WHERE is_local = 1"
+DATABASE_REPLICA_LAG_QUERY = None
+DATABASE_REPLICA_CHECK_INTERVAL = 10
+# Keep a session on the primary for this long after it writes (only when DATABASE_REPLICAS is set)
+DATABASE_PIN_SECONDS = 5
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+
+# Both caches are memory-mapped files shared by every worker process on the host,
+# but not across hosts: a change made on one host bumps the candidate and ballot
+# versions (VOTE_VERSION_CACHE) there only. This assumes a single host serves the
+# election. With several, point VOTE_VERSION_CACHE at a cache all hosts share;
+# until then other hosts see candidate changes only when vote.preload's short
+# PRELOAD_TIMEOUT expires, and may answer ballot ETags from stale versions.
+# Sessions have the same limit and it matters more: a logout, or any other
+# deletion of a session, clears the cached copy on its own host only, so the
+# other hosts keep accepting it for up to the 14 day TIMEOUT below. With several hosts, point
+# SESSION_CACHE_ALIAS at a shared cache or use the plain 'db' SESSION_ENGINE.
+CACHES = {
+    'default': {
+        'BACKEND': 'vote.cache.SharedMemoryCache',
+        'LOCATION': BASE_DIR / 'cache' / 'default.mmap',
+        'OPTIONS': {
+            'MAX_SIZE': 64 * 1024 * 1024,
+            # Version tokens, fragments, candidate lists of large districts
+            'SLOT_SIZES': [512, 4 * 1024, 32 * 1024, 256 * 1024],
+        },
+    },
+    'sessions': {
+        'BACKEND': 'vote.cache.SharedMemoryCache',
+        'LOCATION': BASE_DIR / 'cache' / 'sessions.mmap',
+        'TIMEOUT': 60 * 60 * 24 * 14,
+        'OPTIONS': {
+            'MAX_SIZE': 256 * 1024 * 1024,
+            'SLOT_SIZES': [1024, 4 * 1024],
+        },
+    },
+}
+
+# Cache holding the candidate and ballot versions used for ETags; must be shared by all workers (and hosts)
+VOTE_VERSION_CACHE = 'default'
+
+# Sessions are read from the cache and written through to the database, which stays authoritative.
+# Messages live in a signed cookie so flashing one does not rewrite the session.
+# Compare engines with: python manage.py bench_sessions
+
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+# Host-local: only safe while a single host serves traffic, see CACHES
+SESSION_CACHE_ALIAS = 'sessions'
+MESSAGE_STORAGE = 'django.contrib.messages.storage.cookie.CookieStorage'
+
+# Vote.cast_vote retries deadlocks up to VOTE_CAST_ATTEMPTS times, sleeping up to
+# VOTE_CAST_RETRY_DELAY * 2 ** (attempt - 1) seconds between attempts
+VOTE_CAST_ATTEMPTS = 3
+VOTE_CAST_RETRY_DELAY = 0.05
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -140,6 +217,19 @@ MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
 AUTH_USER_MODEL = 'vote.User'
+AUTHENTICATION_BACKENDS = ['vote.backends.ShardedModelBackend']
 LOGOUT_REDIRECT_URL = 'vote:index'
 
-IMPORT_EXPORT_FORMATS = DEFAULT_FORMATS
+# IMPORT_EXPORT_FORMATS is left at import_export's DEFAULT_FORMATS; importing them
+# here would load tablib and its format backends in every worker
+
+# Request profiling
+# Profiled requests write collapsed stacks (flamegraph.pl format) to VOTE_PROFILER_DIR/<view>.folded
+
+VOTE_PROFILER_ENABLED = False
+VOTE_PROFILER_SAMPLE_RATE = 0.01
+VOTE_PROFILER_HEADER = 'X-Vote-Profile'
+VOTE_PROFILER_INTERVAL = 0.005
+VOTE_PROFILER_DIR = BASE_DIR / 'profiles'
+VOTE_PROFILER_MAX_BYTES = 10 * 1024 * 1024
+VOTE_PROFILER_BACKUP_COUNT = 5
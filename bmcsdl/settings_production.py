@@ -0,0 +1,32 @@
+"""
+Production profile: ``DJANGO_SETTINGS_MODULE=bmcsdl.settings_production``.
+
+Same as ``bmcsdl.settings`` but with DEBUG off. Since Django 4.1 the default
+loaders are already wrapped in the cached loader, DEBUG or not, so templates
+are parsed once per worker in either profile; the loaders are only spelled out
+here to make that explicit.
+"""
+import os
+
+from .settings import *  # noqa: F401,F403
+from .settings import TEMPLATES
+
+DEBUG = False
+
+ALLOWED_HOSTS = os.environ.get('DJANGO_ALLOWED_HOSTS', 'localhost').split(',')
+
+TEMPLATES = [
+    {
+        **TEMPLATES[0],
+        'APP_DIRS': False,
+        'OPTIONS': {
+            **TEMPLATES[0]['OPTIONS'],
+            'loaders': [
+                ('django.template.loaders.cached.Loader', [
+                    'django.template.loaders.filesystem.Loader',
+                    'django.template.loaders.app_directories.Loader',
+                ]),
+            ],
+        },
+    },
+]
@@ -0,0 +1,30 @@
+"""
+Test profile: ``python manage.py test --settings=bmcsdl.settings_test``.
+
+Runs on local SQLite files instead of SQL Server, where the models fall back
+to plain ORM rows. 'shard1' is a second district shard for tests that turn
+sharding on with ``override_settings(DISTRICT_SHARDS=...)``; 'replica' mirrors
+'default' for tests that set ``DATABASE_REPLICAS``. The vote app has
+no committed migrations, so every app's tables are created directly.
+"""
+from .settings import *  # noqa: F401,F403
+from .settings import BASE_DIR
+
+DATABASES = {
+    'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': BASE_DIR / 'test.sqlite3'},
+    'shard1': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': BASE_DIR / 'test-shard1.sqlite3'},
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'test.sqlite3',
+        'TEST': {'MIRROR': 'default'},
+    },
+}
+
+MIGRATION_MODULES = {app: None for app in ('admin', 'auth', 'contenttypes', 'sessions', 'vote')}
+
+CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'sessions': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'sessions'},
+}
+
+PASSWORD_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
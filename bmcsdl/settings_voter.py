@@ -0,0 +1,17 @@
+"""
+Voter-only profile: ``DJANGO_SETTINGS_MODULE=bmcsdl.settings_voter``.
+
+For the workers added on election day. They serve the ballot pages only, so
+the admin, import_export, rangefilter and django_extensions are not
+installed and none of their modules (tablib and its xlsx backend included)
+are imported at startup. Route ``/admin/`` to workers running
+``bmcsdl.settings_production``; here it answers 404.
+"""
+from .settings_production import *  # noqa: F401,F403
+from .settings_production import INSTALLED_APPS
+
+ADMIN_ONLY_APPS = ['django.contrib.admin', 'django_extensions', 'rangefilter', 'import_export']
+
+INSTALLED_APPS = [app for app in INSTALLED_APPS if app not in ADMIN_ONLY_APPS]
+
+ROOT_URLCONF = 'bmcsdl.urls_voter'
@@ -0,0 +1,25 @@
+"""
+URL configuration of the voter-only profile (``bmcsdl.settings_voter``).
+
+The admin is not installed, but ``admin:index`` is kept so that views
+redirecting staff there still reverse to ``/admin/``, which the load balancer
+sends to the full profile.
+"""
+from django.conf import settings
+from django.conf.urls.static import static
+from django.http import Http404
+from django.urls import path, include
+
+
+def admin_elsewhere(request):
+    raise Http404("The admin is not served by voter workers.")
+
+
+admin_patterns = ([
+    path('', admin_elsewhere, name='index'),
+], 'admin')
+
+urlpatterns = [
+    path('admin/', include(admin_patterns)),
+    path('', include('vote.urls')),
+] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
@@ -14,3 +14,9 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'bmcsdl.settings')
 
 application = get_wsgi_application()
+
+# Preload reference data and templates before this worker accepts requests
+if os.environ.get('BMCSDL_WARMUP'):
+    from vote.preload import warm_up
+
+    warm_up()
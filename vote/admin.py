@@ -1,42 +1,83 @@
+from contextlib import ExitStack
+
 from django.contrib import admin
 from django.contrib.admin.views.main import ChangeList
 from django.contrib.auth.forms import UserChangeForm, AdminPasswordChangeForm
-from django.core.exceptions import PermissionDenied
+from django.core.exceptions import PermissionDenied, ValidationError
+from django.db import transaction
 from django.db.models import Count, Q
+from django.http import QueryDict
 from django.template.response import TemplateResponse
 from django.utils.html import format_html
 from rangefilter.filters import (
     DateRangeQuickSelectListFilterBuilder,
 )
-from import_export import resources
+from import_export import fields, resources, widgets
 from import_export.admin import ImportExportModelAdmin
+from import_export.instance_loaders import ModelInstanceLoader
 
 from .models import Candidate, User, District, Term, Vote
+from .sharding import district_shard, is_sharded, shards
+from .validation import BIRTHDATE_FORMAT, validate_voter_roll
+
+
+class RollInstanceLoader(ModelInstanceLoader):
+    def get_instance(self, row):
+        # validate_voter_roll already rejected every id that exists, so rows
+        # that get here are new and need no lookup query
+        if self.resource.roll_report is not None:
+            return None
+        return super().get_instance(row)
 
 
 class UserResource(resources.ModelResource):
+    birthdate = fields.Field(attribute='birthdate', column_name='birthdate',
+                             widget=widgets.DateWidget(format=BIRTHDATE_FORMAT))
+    roll_report = None
+
     class Meta:
         model = User
         fields = ('id', 'name', 'email', 'district', 'birthdate', 'address')
         export_order = ('id', 'name', 'email', 'district', 'birthdate', 'address')
+        instance_loader_class = RollInstanceLoader
+
+    def import_data(self, dataset, dry_run=False, raise_errors=False, use_transactions=None,
+                    collect_failed_rows=False, rollback_on_validation_errors=False, **kwargs):
+        # import_export only opens a transaction on the default database, but
+        # User.save writes each voter to its district's shard. Hold one on
+        # every other shard too, so a dry run or a failed import leaves none
+        # of them behind.
+        if use_transactions is None:
+            use_transactions = self.get_use_transactions()
+        others = []
+        if is_sharded() and (use_transactions or dry_run):
+            others = [alias for alias in shards() if alias != self.get_db_connection_name()]
+        with ExitStack() as stack:
+            for alias in others:
+                stack.enter_context(transaction.atomic(using=alias))
+            result = super().import_data(dataset, dry_run, raise_errors, use_transactions, collect_failed_rows,
+                                         rollback_on_validation_errors, **kwargs)
+            if dry_run or result.has_errors() or (rollback_on_validation_errors and result.has_validation_errors()):
+                for alias in others:
+                    transaction.set_rollback(True, using=alias)
+        return result
+
+    def before_import(self, dataset, **kwargs):
+        self.roll_report = validate_voter_roll(dataset)
+        if self.roll_report.file_errors:
+            raise ValidationError(self.roll_report.file_errors)
+        return super().before_import(dataset, **kwargs)
+
+    def before_import_row(self, row, **kwargs):
+        errors = self.roll_report.errors_for(kwargs.get('row_number'))
+        if errors:
+            raise ValidationError(errors)
+        return super().before_import_row(row, **kwargs)
 
     def skip_row(self, instance, original, row, import_validation_errors=None):
-        if not row.get('district') or row.get('district') == 'None' or row.get('district') == '':
-            return True
-        if not row.get('id') or row.get('id') == 'None' or row.get('id') == '':
+        # Nothing is written unless the whole file passed the pre-flight checks
+        if self.roll_report.has_errors:
             return True
-        if not row.get('email') or row.get('email') == 'None' or row.get('email') == '':
-            return True
-        if not row.get('name') or row.get('name') == 'None' or row.get('name') == '':
-            return True
-        if not row.get('address') or row.get('address') == 'None' or row.get('address') == '':
-            return True
-        if not row.get('birthdate') or row.get('birthdate') == 'None' or row.get('birthdate') == '':
-            return True
-        if row.get('birthdate'):
-            from datetime import datetime
-            if (datetime.now() - row.get('birthdate')).days < 18 * 365:
-                return True
         return super().skip_row(instance, original, row, import_validation_errors)
 
 
@@ -47,7 +88,29 @@ class CustomUserChangeList(ChangeList):
         return super().url_for_result(result)
 
 
-class CandidateAdmin(admin.ModelAdmin):
+class DistrictShardAdminMixin:
+    """Points the admin queryset at the shard of the district being looked at.
+
+    Staff are limited to their own district; superusers pick one with the
+    district list filter, which is kept across change views.
+    """
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        if is_sharded():
+            queryset = queryset.using(district_shard(self.get_shard_district(request)))
+        return queryset
+
+    def get_shard_district(self, request):
+        if not request.user.is_superuser:
+            return request.user.district_id
+        district_id = request.GET.get('district__id__exact')
+        if district_id is None:
+            district_id = QueryDict(request.GET.get('_changelist_filters', '')).get('district__id__exact')
+        return district_id
+
+
+class CandidateAdmin(DistrictShardAdminMixin, admin.ModelAdmin):
     readonly_fields = ["image_tag"]
     list_display = ["name", "district", "image_tag", "vote_count"]
     list_filter = ["district"]
@@ -79,12 +142,13 @@ class CustomUserChangeForm(UserChangeForm):
         fields = '__all__'
 
 
-class CustomUserAdmin(ImportExportModelAdmin):
+class CustomUserAdmin(DistrictShardAdminMixin, ImportExportModelAdmin):
     resource_classes = [UserResource]
 
     form = CustomUserChangeForm
     exclude = ["username"]
     list_display = ["id", "name", "email", "district", "show_voted"]
+    list_filter = ["district"]
     fields = [
         "id",
         "name",
@@ -181,6 +245,8 @@ class VoteAdmin(admin.ModelAdmin):
         return False  # Disable deleting votes through the admin interface
 
 
+admin.site.index_template = 'admin/vote_index.html'
+
 admin.site.register(Candidate, CandidateAdmin)
 admin.site.register(User, CustomUserAdmin)
 admin.site.register(District)
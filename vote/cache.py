@@ -0,0 +1,331 @@
+import hashlib
+import logging
+import mmap
+import os
+import pickle
+import struct
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.core.exceptions import ImproperlyConfigured
+
+try:
+    import fcntl
+except ImportError:  # Windows: entries are only shared between threads
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'VOTEMMC2'
+# magic, number of size classes
+HEADER = struct.Struct('<8sI')
+# per size class: data offset, number of sets, ways per set, slot size
+CLASS = struct.Struct('<QIII')
+# key hash (0 = empty), expiry (0 = never), last use, key length, value length
+SLOT = struct.Struct('<QddII')
+MAX_CLASSES = 8
+INIT_LOCK_OFFSET = 256
+LOCK_OFFSET = 512
+DATA_OFFSET = mmap.PAGESIZE * ((LOCK_OFFSET + 4096) // mmap.PAGESIZE + 1)
+DEFAULT_SLOT_SIZES = (512, 4 * 1024, 32 * 1024, 256 * 1024)
+
+SizeClass = namedtuple('SizeClass', 'offset sets ways slot_size')
+
+
+class SharedFile:
+    """Descriptor, mapping and stripe locks of one cache file in this process.
+
+    ``fcntl`` locks are owned by the process, so they only exclude other
+    processes; threads are excluded by the stripe's ``threading.Lock``. Django
+    builds one backend instance per thread, hence these live at module level,
+    shared by every instance using the same file.
+    """
+
+    def __init__(self, path, size, header, lock_count):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if fcntl is not None:
+            fcntl.lockf(fd, fcntl.LOCK_EX, 1, INIT_LOCK_OFFSET)
+        try:
+            found_size = os.fstat(fd).st_size
+            found_header = os.pread(fd, len(header), 0)
+            # A new file, or one whose creator died before writing the header
+            fresh = found_size == 0 or (found_size == size and not found_header.strip(b'\0'))
+            if fresh:
+                os.ftruncate(fd, size)
+                os.pwrite(fd, header, 0)
+        finally:
+            if fcntl is not None:
+                fcntl.lockf(fd, fcntl.LOCK_UN, 1, INIT_LOCK_OFFSET)
+        # Never resize or clear an existing file: workers that have it mapped
+        # would die with SIGBUS
+        if not fresh and (found_size != size or found_header != header):
+            os.close(fd)
+            raise ImproperlyConfigured(
+                f"Cache file {path} was created with different OPTIONS. Give the new OPTIONS "
+                f"another LOCATION, or remove the file once no worker uses it."
+            )
+        self.fd = fd
+        self.mm = mmap.mmap(fd, size)
+        self.geometry = (size, header, lock_count)
+        self.thread_locks = [threading.Lock() for _ in range(lock_count)]
+
+    def close(self):
+        self.mm.close()
+        os.close(self.fd)
+
+
+# (path, pid) -> SharedFile
+_shared_files = {}
+_shared_files_lock = threading.Lock()
+
+
+def shared_file(path, size, header, lock_count):
+    pid = os.getpid()
+    with _shared_files_lock:
+        found = _shared_files.get((path, pid))
+        if found is None:
+            # Inherited across fork: the parent's locks may be held and its fcntl locks are not ours
+            for key in [key for key in _shared_files if key[1] != pid]:
+                _shared_files.pop(key).close()
+            found = _shared_files[(path, pid)] = SharedFile(path, size, header, lock_count)
+        elif found.geometry != (size, header, lock_count):
+            raise ImproperlyConfigured(f"Cache file {path} is configured twice with different OPTIONS.")
+        return found
+
+
+class SharedMemoryCache(BaseCache):
+    """Host-wide cache in a memory-mapped file shared by every worker process.
+
+    ``MAX_SIZE`` is split evenly between size classes, one per entry of
+    ``SLOT_SIZES``, and a value is stored in the smallest class whose slots
+    fit it, so small entries such as version tokens do not take up large
+    slots. Each class is a set-associative table: a key hashes to one set of
+    ``WAYS`` fixed-size slots and, when the set is full, the least recently
+    used slot in it is evicted, so memory use never exceeds ``MAX_SIZE``.
+    Sets are guarded by ``LOCKS`` striped locks (``fcntl`` byte-range locks
+    between processes, plus a thread lock shared by every instance in the
+    process), reads taking them shared. Values larger than the largest slot
+    are not cached and logged as a warning. The file keeps the geometry it
+    was created with; changed OPTIONS need another ``LOCATION``.
+
+    OPTIONS: ``MAX_SIZE`` (bytes, default 64 MiB), ``SLOT_SIZES`` (default
+    512 B, 4 KiB, 32 KiB and 256 KiB), ``WAYS`` (default 8), ``LOCKS``
+    (default 64, at most 4096).
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self.path = os.path.abspath(str(location))
+        slot_sizes = sorted(int(size) for size in options.get('SLOT_SIZES', DEFAULT_SLOT_SIZES))
+        if not 0 < len(slot_sizes) <= MAX_CLASSES:
+            raise ImproperlyConfigured(f"SLOT_SIZES must list 1 to {MAX_CLASSES} sizes.")
+        ways = int(options.get('WAYS', 8))
+        share = int(options.get('MAX_SIZE', 64 * 1024 * 1024)) // len(slot_sizes)
+        self.classes = []
+        offset = DATA_OFFSET
+        for slot_size in slot_sizes:
+            size_class = SizeClass(offset, max(1, share // (slot_size * ways)), ways, slot_size)
+            self.classes.append(size_class)
+            offset += size_class.sets * ways * slot_size
+        self.size = offset
+        self.lock_count = min(int(options.get('LOCKS', 64)), 4096)
+        self._shared = None
+        self._pid = None
+
+    # File and locks
+
+    def _file(self):
+        if self._shared is None or self._pid != os.getpid():
+            header = HEADER.pack(MAGIC, len(self.classes)) + b''.join(CLASS.pack(*c) for c in self.classes)
+            self._shared = shared_file(self.path, self.size, header, self.lock_count)
+            self._pid = os.getpid()
+        return self._shared
+
+    @contextmanager
+    def _locked(self, class_index, set_index, exclusive=True):
+        shared = self._file()
+        stripe = (set_index * len(self.classes) + class_index) % self.lock_count
+        with shared.thread_locks[stripe]:
+            if fcntl is not None:
+                fcntl.lockf(shared.fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH, 1, LOCK_OFFSET + stripe)
+            try:
+                yield shared.mm
+            finally:
+                if fcntl is not None:
+                    fcntl.lockf(shared.fd, fcntl.LOCK_UN, 1, LOCK_OFFSET + stripe)
+
+    # Slots
+
+    def _locate(self, key):
+        key_bytes = key.encode()
+        key_hash = int.from_bytes(hashlib.blake2b(key_bytes, digest_size=8).digest(), 'little') or 1
+        return key_bytes, key_hash
+
+    def _offsets(self, size_class, set_index):
+        start = size_class.offset + set_index * size_class.ways * size_class.slot_size
+        return range(start, start + size_class.ways * size_class.slot_size, size_class.slot_size)
+
+    def _find(self, mm, size_class, set_index, key_bytes, key_hash):
+        for offset in self._offsets(size_class, set_index):
+            slot_hash, expires, last_used, key_length, value_length = SLOT.unpack_from(mm, offset)
+            if slot_hash == key_hash and mm[offset + SLOT.size:offset + SLOT.size + key_length] == key_bytes:
+                return offset, expires, value_length
+        return None
+
+    def _live(self, mm, size_class, set_index, key_bytes, key_hash):
+        found = self._find(mm, size_class, set_index, key_bytes, key_hash)
+        if found is None or (found[1] and found[1] <= time.time()):
+            return None
+        return found
+
+    def _read_value(self, mm, offset, key_length, value_length):
+        start = offset + SLOT.size + key_length
+        return pickle.loads(mm[start:start + value_length])
+
+    def _victim(self, mm, size_class, set_index):
+        now = time.time()
+        victim, oldest = None, None
+        for offset in self._offsets(size_class, set_index):
+            slot_hash, expires, last_used, _, _ = SLOT.unpack_from(mm, offset)
+            if slot_hash == 0 or (expires and expires <= now):
+                return offset
+            if oldest is None or last_used < oldest:
+                victim, oldest = offset, last_used
+        return victim
+
+    def _write(self, mm, size_class, set_index, key_bytes, key_hash, data, expires):
+        found = self._find(mm, size_class, set_index, key_bytes, key_hash)
+        offset = found[0] if found is not None else self._victim(mm, size_class, set_index)
+        start = offset + SLOT.size
+        mm[start:start + len(key_bytes)] = key_bytes
+        mm[start + len(key_bytes):start + len(key_bytes) + len(data)] = data
+        SLOT.pack_into(mm, offset, key_hash, expires or 0.0, time.time(), len(key_bytes), len(data))
+
+    def _class_for(self, key, key_bytes, data):
+        needed = SLOT.size + len(key_bytes) + len(data)
+        for class_index, size_class in enumerate(self.classes):
+            if needed <= size_class.slot_size:
+                return class_index
+        logger.warning("Not caching %s: %d bytes do not fit in the largest %d byte slot",
+                       key, needed, self.classes[-1].slot_size)
+        return None
+
+    def _sets(self, key_hash):
+        """Yields (class index, set index) of the key in every size class, smallest first."""
+        for class_index, size_class in enumerate(self.classes):
+            yield class_index, key_hash % size_class.sets
+
+    def _discard(self, key_bytes, key_hash, keep=None):
+        discarded = False
+        for class_index, set_index in self._sets(key_hash):
+            if class_index == keep:
+                continue
+            size_class = self.classes[class_index]
+            with self._locked(class_index, set_index) as mm:
+                found = self._live(mm, size_class, set_index, key_bytes, key_hash)
+                if found is not None:
+                    SLOT.pack_into(mm, found[0], 0, 0.0, 0.0, 0, 0)
+                    discarded = True
+        return discarded
+
+    def _store(self, key, key_bytes, key_hash, value, expires, only_new=False):
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        class_index = self._class_for(key, key_bytes, data)
+        if class_index is None:
+            self._discard(key_bytes, key_hash)
+            return False
+        if only_new and self._get(key_bytes, key_hash, skip=class_index)[0]:
+            return False
+        size_class = self.classes[class_index]
+        set_index = key_hash % size_class.sets
+        with self._locked(class_index, set_index) as mm:
+            if only_new and self._live(mm, size_class, set_index, key_bytes, key_hash) is not None:
+                return False
+            self._write(mm, size_class, set_index, key_bytes, key_hash, data, expires)
+        # A previous value of another size lives in another class
+        self._discard(key_bytes, key_hash, keep=class_index)
+        return True
+
+    def _get(self, key_bytes, key_hash, skip=None):
+        """Returns (found, value) from the first class holding the key."""
+        for class_index, set_index in self._sets(key_hash):
+            if class_index == skip:
+                continue
+            size_class = self.classes[class_index]
+            with self._locked(class_index, set_index, exclusive=False) as mm:
+                found = self._live(mm, size_class, set_index, key_bytes, key_hash)
+                if found is None:
+                    continue
+                offset, _, value_length = found
+                # Concurrent readers may race on this timestamp; it only orders evictions
+                struct.pack_into('<d', mm, offset + 16, time.time())
+                return True, self._read_value(mm, offset, len(key_bytes), value_length)
+        return False, None
+
+    # Cache API
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        key_bytes, key_hash = self._locate(key)
+        return self._store(key, key_bytes, key_hash, value, self.get_backend_timeout(timeout), only_new=True)
+
+    def get(self, key, default=None, version=None):
+        key_bytes, key_hash = self._locate(self.make_and_validate_key(key, version=version))
+        found, value = self._get(key_bytes, key_hash)
+        return value if found else default
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        key_bytes, key_hash = self._locate(key)
+        return self._store(key, key_bytes, key_hash, value, self.get_backend_timeout(timeout))
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key_bytes, key_hash = self._locate(self.make_and_validate_key(key, version=version))
+        for class_index, set_index in self._sets(key_hash):
+            size_class = self.classes[class_index]
+            with self._locked(class_index, set_index) as mm:
+                found = self._live(mm, size_class, set_index, key_bytes, key_hash)
+                if found is not None:
+                    struct.pack_into('<d', mm, found[0] + 8, self.get_backend_timeout(timeout) or 0.0)
+                    return True
+        return False
+
+    def incr(self, key, delta=1, version=None):
+        full_key = self.make_and_validate_key(key, version=version)
+        key_bytes, key_hash = self._locate(full_key)
+        for class_index, set_index in self._sets(key_hash):
+            size_class = self.classes[class_index]
+            with self._locked(class_index, set_index) as mm:
+                found = self._live(mm, size_class, set_index, key_bytes, key_hash)
+                if found is None:
+                    continue
+                offset, expires, value_length = found
+                value = self._read_value(mm, offset, len(key_bytes), value_length) + delta
+                data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+                if SLOT.size + len(key_bytes) + len(data) <= size_class.slot_size:
+                    self._write(mm, size_class, set_index, key_bytes, key_hash, data, expires)
+                    return value
+            # Outgrew its slot: move it to a larger class
+            self._store(full_key, key_bytes, key_hash, value, expires)
+            return value
+        raise ValueError("Key '%s' not found" % key)
+
+    def delete(self, key, version=None):
+        key_bytes, key_hash = self._locate(self.make_and_validate_key(key, version=version))
+        return self._discard(key_bytes, key_hash)
+
+    def clear(self):
+        for class_index, size_class in enumerate(self.classes):
+            for set_index in range(size_class.sets):
+                with self._locked(class_index, set_index) as mm:
+                    for offset in self._offsets(size_class, set_index):
+                        SLOT.pack_into(mm, offset, 0, 0.0, 0.0, 0, 0)
+
+    def close(self, **kwargs):
+        # The mapping is kept open for the life of the process
+        pass
@@ -0,0 +1,63 @@
+import time
+from importlib import import_module
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test.utils import CaptureQueriesContext
+
+DB_ENGINE = 'django.contrib.sessions.backends.db'
+
+
+class Command(BaseCommand):
+    help = "Compares the database session engine with SESSION_ENGINE on the configured database."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sessions', type=int, default=1000)
+        parser.add_argument('--reads', type=int, default=10, help="Requests served per session.")
+        parser.add_argument('--engine', action='append', dest='engines',
+                            help="Session engine to measure, may be repeated.")
+
+    def handle(self, *args, **options):
+        engines = options['engines'] or list(dict.fromkeys([DB_ENGINE, settings.SESSION_ENGINE]))
+        self.stdout.write(f"{'engine':<45} {'phase':<8} {'ops/s':>10} {'queries':>8}")
+        for engine in engines:
+            store_class = import_module(engine).SessionStore
+            keys = []
+
+            def create():
+                for i in range(options['sessions']):
+                    session = store_class()
+                    session['bench'] = i
+                    session.save(must_create=True)
+                    keys.append(session.session_key)
+
+            def read():
+                for _ in range(options['reads']):
+                    for key in keys:
+                        store_class(key).load()
+
+            def update():
+                for key in keys:
+                    session = store_class(key)
+                    session['bench'] = -1
+                    session.save()
+
+            def delete():
+                for key in keys:
+                    store_class(key).delete()
+
+            try:
+                self.measure(engine, 'create', create, options['sessions'])
+                self.measure(engine, 'read', read, options['reads'] * len(keys))
+                self.measure(engine, 'update', update, len(keys))
+            finally:
+                self.measure(engine, 'delete', delete, len(keys))
+
+    def measure(self, engine, phase, func, operations):
+        with CaptureQueriesContext(connections[DEFAULT_DB_ALIAS]) as queries:
+            start = time.perf_counter()
+            func()
+            elapsed = time.perf_counter() - start
+        rate = operations / elapsed if elapsed else float('inf')
+        self.stdout.write(f"{engine:<45} {phase:<8} {rate:>10.0f} {len(queries):>8}")
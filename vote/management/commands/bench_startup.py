@@ -0,0 +1,68 @@
+import os
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+PROFILES = ['bmcsdl.settings', 'bmcsdl.settings_voter']
+
+# What a worker does before its first request: set up Django and load the URLconf
+STARTUP_SCRIPT = "import django; django.setup(); from django.urls import get_resolver; get_resolver().url_patterns"
+WARMUP_SCRIPT = STARTUP_SCRIPT + "; from vote.preload import warm_up; warm_up()"
+
+
+class Command(BaseCommand):
+    help = ("Measures worker startup per settings profile in fresh interpreters: wall time of django.setup() "
+            "plus the URLconf, and the slowest top-level imports reported by python -X importtime.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profile', action='append', dest='profiles',
+                            help="Settings module to measure, may be repeated. Defaults to the full and voter profiles.")
+        parser.add_argument('--runs', type=int, default=5)
+        parser.add_argument('--top', type=int, default=10, help="Slowest top-level imports to list per profile.")
+        parser.add_argument('--warmup', action='store_true', help="Include warm_up() in the measured startup.")
+
+    def handle(self, *args, **options):
+        script = WARMUP_SCRIPT if options['warmup'] else STARTUP_SCRIPT
+        self.stdout.write(f"{'profile':<30} {'median s':>9} {'min s':>9} {'imports':>8}")
+        reports = {}
+        for profile in options['profiles'] or PROFILES:
+            timings = []
+            for _ in range(options['runs']):
+                start = time.perf_counter()
+                result = self.run(profile, script)
+                timings.append(time.perf_counter() - start)
+            reports[profile] = self.top_imports(result.stderr)
+            self.stdout.write(f"{profile:<30} {statistics.median(timings):>9.3f} {min(timings):>9.3f} "
+                              f"{reports[profile][0]:>8}")
+
+        for profile, (_, packages) in reports.items():
+            self.stdout.write(f"\n{profile}: slowest imports (cumulative ms)")
+            for package, microseconds in packages[:options['top']]:
+                self.stdout.write(f"  {microseconds / 1000:>8.1f}  {package}")
+
+    def run(self, profile, script):
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=profile)
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', script], cwd=settings.BASE_DIR,
+                                env=env, capture_output=True, text=True)
+        if result.returncode:
+            raise CommandError(f"{profile} failed to start:\n{result.stderr[-2000:]}")
+        return result
+
+    def top_imports(self, importtime):
+        """Returns the number of modules imported and cumulative time per top-level package, slowest first."""
+        modules = 0
+        packages = defaultdict(int)
+        for line in importtime.splitlines():
+            if not line.startswith('import time:') or 'self [us]' in line:
+                continue
+            _, cumulative, name = line[len('import time:'):].split('|', 2)
+            modules += 1
+            # Nested imports are indented and already counted in their parent
+            if not name[1:].startswith(' '):
+                packages[name.strip().split('.')[0]] += int(cumulative)
+        return modules, sorted(packages.items(), key=lambda item: item[1], reverse=True)
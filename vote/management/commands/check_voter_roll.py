@@ -0,0 +1,34 @@
+import os
+
+import tablib
+from django.core.management.base import BaseCommand, CommandError
+
+from vote.validation import validate_voter_roll
+
+
+class Command(BaseCommand):
+    help = "Validates a voter roll file (csv, xlsx, ...) without importing it."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', help="File format, defaults to the file extension.")
+        parser.add_argument('--database', default=None)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or os.path.splitext(path)[1].lstrip('.').lower()
+        try:
+            with open(path, 'rb') as f:
+                content = f.read()
+            if file_format in ('csv', 'tsv', 'json', 'yaml', 'html'):
+                content = content.decode('utf-8-sig')
+            dataset = tablib.Dataset().load(content, format=file_format)
+        except (OSError, tablib.UnsupportedFormat) as e:
+            raise CommandError(f"Cannot read {path}: {e}")
+
+        report = validate_voter_roll(dataset, using=options['database'])
+        for line in report.lines():
+            self.stdout.write(line)
+        if report.has_errors:
+            raise CommandError(f"{len(report.row_errors)} of {report.total_rows} rows have errors.")
+        self.stdout.write(self.style.SUCCESS(f"{report.total_rows} row(s) ready to import."))
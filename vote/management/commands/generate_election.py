@@ -0,0 +1,191 @@
+import datetime
+import io
+import random
+import time
+from collections import defaultdict
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from vote.models import Candidate, District, Term, User, Vote
+from vote.sharding import district_shard, scatter_gather, shards
+from vote.turnout import reconcile_turnout
+
+FAMILY_NAMES = ['Nguyễn', 'Trần', 'Lê', 'Phạm', 'Hoàng', 'Huỳnh', 'Phan', 'Vũ', 'Võ', 'Đặng', 'Bùi', 'Đỗ', 'Hồ', 'Ngô', 'Dương', 'Lý']
+MIDDLE_NAMES = ['Văn', 'Thị', 'Hữu', 'Đức', 'Minh', 'Ngọc', 'Thanh', 'Quốc', 'Gia', 'Hoài']
+GIVEN_NAMES = ['An', 'Bình', 'Châu', 'Dũng', 'Giang', 'Hà', 'Hải', 'Hạnh', 'Hùng', 'Khánh', 'Lan', 'Linh', 'Long', 'Mai',
+               'Nam', 'Nga', 'Phúc', 'Phương', 'Quân', 'Sơn', 'Tâm', 'Thảo', 'Trang', 'Trung', 'Tuấn', 'Vy', 'Yến']
+STREETS = ['Lê Lợi', 'Nguyễn Huệ', 'Trần Hưng Đạo', 'Hai Bà Trưng', 'Lý Thường Kiệt', 'Điện Biên Phủ', 'Cách Mạng Tháng Tám']
+
+INSERT_USER_SQL = (
+    'EXECUTE dbo.SP_InsertEncryptedUser @id = %s, @name = %s, @birthdate = %s, @address = %s, @district_id = %s, '
+    '@email = %s, @password = %s, @last_login = %s, @is_superuser = %s, @is_staff = %s, @is_active = 1'
+)
+INSERT_VOTE_SQL = 'EXECUTE dbo.SP_InsertEncryptedVote @user = %s, @candidate_id = %s'
+# SQL Server accepts at most 2100 parameters per statement
+MAX_IN_PARAMS = 2000
+
+
+class Command(BaseCommand):
+    help = ("Generates a reproducible synthetic election (districts, a term, candidates with images, voters and votes) "
+            "and bulk-loads it. On SQL Server rows go through the encryption procedures with executemany; other "
+            "databases such as a local SQLite stand-in get plain bulk inserts, and the models read them back "
+            "without the decryption procedures.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--districts', type=int, default=10)
+        parser.add_argument('--candidates', type=int, default=5, help="Candidates per district.")
+        parser.add_argument('--voters', type=int, default=100000)
+        parser.add_argument('--turnout', type=float, default=0.6, help="Fraction of voters who vote.")
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--id-prefix', default='SYN',
+                            help="Prefix of generated voter and candidate ids; must not be in use yet.")
+        parser.add_argument('--as-of', type=datetime.date.fromisoformat, default='2025-01-01',
+                            help="Date the term and the ages are computed from, YYYY-MM-DD.")
+        parser.add_argument('--password', default='Voter@2025',
+                            help="Password of every generated voter; hashed once and reused.")
+        parser.add_argument('--database', default=None,
+                            help="Load everything into this alias instead of routing by district shard.")
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.database = options['database']
+        self.prefix = options['id_prefix']
+        self.as_of = options['as_of']
+        self.check_prefix_unused()
+        started = time.perf_counter()
+
+        districts = self.create_districts(options['districts'])
+        term = self.create_term()
+        candidates = self.create_candidates(districts, term, options['candidates'])
+        self.stdout.write(f"{len(districts)} districts, {sum(map(len, candidates.values()))} candidates")
+
+        password = make_password(options['password'])
+        loaded = voted = 0
+        for start in range(0, options['voters'], options['batch_size']):
+            count = min(options['batch_size'], options['voters'] - start)
+            users, votes = self.generate_voters(start, count, districts, candidates, password, options['turnout'])
+            self.load_users(users)
+            self.load_votes(votes)
+            loaded += len(users)
+            voted += len(votes)
+            self.stdout.write(f"{loaded} voters, {voted} votes ({time.perf_counter() - started:.1f}s)")
+
+        if self.database is None:
+            reconcile_turnout(term)
+        self.stdout.write(self.style.SUCCESS(f"Generated {loaded} voters and {voted} votes in {time.perf_counter() - started:.1f}s"))
+
+    def alias_for(self, district_id):
+        return self.database or district_shard(district_id)
+
+    def check_prefix_unused(self):
+        def in_use(alias):
+            return (User.objects.using(alias).filter(id__startswith=self.prefix).exists()
+                    or Candidate.objects.using(alias).filter(id__startswith=self.prefix).exists())
+
+        if any(scatter_gather(in_use, [self.database] if self.database else shards())):
+            raise CommandError(f"Ids starting with {self.prefix!r} already exist; pass another --id-prefix.")
+
+    def create_districts(self, count):
+        districts = []
+        for i in range(1, count + 1):
+            district = District(short_name=f"{self.prefix}{i:02d}"[:10], long_name=f"Khu vực bầu cử số {i}",
+                                description=f"Khu vực tổng hợp số {i}")
+            district.save(using=self.database)
+            districts.append(district)
+        return districts
+
+    def create_term(self):
+        start = self.as_of.replace(month=1, day=1)
+        term = Term(start=start, end=start.replace(year=start.year + 5))
+        term.save(using=self.database)
+        return term
+
+    def create_candidates(self, districts, term, per_district):
+        candidates = defaultdict(list)
+        for district in districts:
+            for i in range(per_district):
+                candidate = Candidate(
+                    id=f"{self.prefix}C{district.pk:03d}{i:03d}",
+                    name=self.random_name(),
+                    birthdate=self.random_birthdate(30, 70),
+                    district_id=district.pk,
+                    term_id=term.pk,
+                    description="Ứng cử viên được tạo tự động để kiểm thử tải.",
+                )
+                candidate.image.save(f"{candidate.id}.png", ContentFile(self.random_image()), save=False)
+                candidate.save(using=self.alias_for(district.pk))
+                candidates[district.pk].append(candidate.id)
+        return candidates
+
+    def generate_voters(self, start, count, districts, candidates, password, turnout):
+        users, votes = [], []
+        for n in range(start, start + count):
+            district = self.rng.choice(districts)
+            user = User(
+                id=f"{self.prefix}{n:012d}",
+                name=self.random_name(),
+                birthdate=self.random_birthdate(18, 90),
+                address=f"Số {self.rng.randint(1, 500)} đường {self.rng.choice(STREETS)}, {district.long_name}",
+                district_id=district.pk,
+                email=f"{self.prefix.lower()}{n}@example.vn",
+                password=password,
+            )
+            if candidates[district.pk] and self.rng.random() < turnout:
+                user.voted = True
+                votes.append((user.id, district.pk, self.rng.choice(candidates[district.pk])))
+            users.append(user)
+        return users, votes
+
+    def load_users(self, users):
+        by_alias = defaultdict(list)
+        for user in users:
+            by_alias[self.alias_for(user.district_id)].append(user)
+        for alias, batch in by_alias.items():
+            connection = connections[alias]
+            if connection.vendor == 'microsoft':
+                rows = [[u.id, u.name, u.birthdate, u.address, u.district_id, u.email, u.password, None, False, False]
+                        for u in batch]
+                with connection.cursor() as cursor:
+                    cursor.executemany(INSERT_USER_SQL, rows)
+            else:
+                User.objects.using(alias).bulk_create(batch, batch_size=len(batch))
+
+    def load_votes(self, votes):
+        by_alias = defaultdict(list)
+        for user_id, district_id, candidate_id in votes:
+            by_alias[self.alias_for(district_id)].append((user_id, candidate_id))
+        for alias, batch in by_alias.items():
+            connection = connections[alias]
+            if connection.vendor == 'microsoft':
+                with connection.cursor() as cursor:
+                    cursor.executemany(INSERT_VOTE_SQL, batch)
+                # SP_InsertEncryptedUser has no voted parameter
+                user_ids = [user_id for user_id, _ in batch]
+                for i in range(0, len(user_ids), MAX_IN_PARAMS):
+                    User.objects.using(alias).filter(id__in=user_ids[i:i + MAX_IN_PARAMS]).update(voted=True)
+            else:
+                Vote.objects.using(alias).bulk_create(
+                    [Vote(user=user_id, candidate_id=candidate_id) for user_id, candidate_id in batch],
+                    batch_size=len(batch),
+                )
+
+    def random_name(self):
+        return f"{self.rng.choice(FAMILY_NAMES)} {self.rng.choice(MIDDLE_NAMES)} {self.rng.choice(GIVEN_NAMES)}"
+
+    def random_birthdate(self, min_age, max_age):
+        return self.as_of - datetime.timedelta(days=self.rng.randint(min_age * 366, max_age * 365))
+
+    def random_image(self):
+        from PIL import Image, ImageDraw
+
+        image = Image.new('RGB', (200, 200), tuple(self.rng.randint(60, 200) for _ in range(3)))
+        draw = ImageDraw.Draw(image)
+        draw.ellipse((50, 30, 150, 130), fill=(240, 240, 240))
+        draw.rectangle((35, 140, 165, 200), fill=(240, 240, 240))
+        content = io.BytesIO()
+        image.save(content, format='PNG')
+        return content.getvalue()
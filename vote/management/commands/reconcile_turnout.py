@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from vote.turnout import reconcile_turnout
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the turnout counters of the current term from the user tables. Meant to run periodically, e.g. from cron."
+
+    def handle(self, *args, **options):
+        counters = reconcile_turnout()
+        for counter in counters:
+            self.stdout.write(str(counter))
+        self.stdout.write(self.style.SUCCESS(f"Reconciled {len(counters)} district(s)."))
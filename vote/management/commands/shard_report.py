@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Q
+
+from vote.models import Candidate, District, User
+from vote.sharding import scatter_gather, shards
+
+
+def district_counts(alias):
+    users = User.objects.using(alias).filter(is_staff=False).values('district_id').annotate(
+        voters=Count('pk'),
+        voted=Count('pk', filter=Q(voted=True)),
+    )
+    candidates = Candidate.objects.using(alias).values('district_id').annotate(candidates=Count('pk'))
+    counts = {}
+    for row in users:
+        counts.setdefault(row['district_id'], {}).update(voters=row['voters'], voted=row['voted'])
+    for row in candidates:
+        counts.setdefault(row['district_id'], {})['candidates'] = row['candidates']
+    return counts
+
+
+class Command(BaseCommand):
+    help = "Prints voters, turnout and candidates per district, gathered from every shard."
+
+    def handle(self, *args, **options):
+        districts = {district.pk: str(district) for district in District.objects.all()}
+        self.stdout.write(f"{'shard':<12} {'district':<40} {'voters':>8} {'voted':>8} {'candidates':>10}")
+        totals = {'voters': 0, 'voted': 0, 'candidates': 0}
+        for alias, counts in zip(shards(), scatter_gather(district_counts)):
+            for district_id, row in sorted(counts.items(), key=lambda item: str(item[0])):
+                for key in totals:
+                    totals[key] += row.get(key, 0)
+                self.stdout.write(
+                    f"{alias:<12} {districts.get(district_id, district_id)!s:<40} "
+                    f"{row.get('voters', 0):>8} {row.get('voted', 0):>8} {row.get('candidates', 0):>10}"
+                )
+        self.stdout.write(f"{'total':<53} {totals['voters']:>8} {totals['voted']:>8} {totals['candidates']:>10}")
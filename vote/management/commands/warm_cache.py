@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from vote.preload import warm_up
+
+
+class Command(BaseCommand):
+    help = ("Loads districts and candidate lists into the shared cache and compiles the voter templates. "
+            "Run it once per host before workers take traffic, or set BMCSDL_WARMUP=1 to warm each worker "
+            "from wsgi.py.")
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        loaded = warm_up()
+        self.stdout.write(self.style.SUCCESS(
+            f"Warmed {loaded['districts']} districts, {loaded['candidates']} candidates and "
+            f"{loaded['templates']} templates in {time.perf_counter() - start:.2f}s"
+        ))
+        if loaded['skipped']:
+            self.stdout.write(self.style.WARNING(
+                f"Candidate lists of districts {', '.join(map(str, loaded['skipped']))} are too large "
+                f"for the cache and were not stored"
+            ))
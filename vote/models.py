@@ -1,10 +1,38 @@
-from django.contrib import admin
+import random
+import time
+from functools import partial
+
+from django.conf import settings
 from django.contrib.auth.base_user import BaseUserManager
-from django.db import models, connection
+from django.db import models, connections, router, transaction, DatabaseError
+from django.db.models import OuterRef, Subquery
 from django.utils.functional import SimpleLazyObject
 from django.utils.safestring import mark_safe
 from django.contrib.auth.models import AbstractUser
 
+from .routers import pin_to_primary
+from .sharding import (
+    district_shard, is_sharded, locate_user, move_to_shard, remember_user_shard, shard_for_instance, shard_move,
+)
+from .turnout import record_registration, record_vote
+from .versions import bump_ballot_version
+
+
+# SQL Server deadlock victim (1205), snapshot update conflict (3960) and the
+# generic serialization failure SQLSTATE
+RETRYABLE_DB_ERRORS = ('40001', '1205', '3960')
+
+
+def is_retryable_error(error):
+    cause = error.__cause__ or error
+    return any(code in str(arg) for arg in cause.args for code in RETRYABLE_DB_ERRORS)
+
+
+def uses_procedures(alias):
+    # Encryption is done by stored procedures on SQL Server. Other databases,
+    # such as local SQLite files for development and tests, hold plain rows.
+    return connections[alias].vendor == 'microsoft'
+
 
 def validate_id(value: str):
     if len(value) < 3:
@@ -22,6 +50,9 @@ class District(models.Model):
 
 
 class UserManager(BaseUserManager):
+    def get_by_natural_key(self, id):
+        return self.db_manager(self._db or locate_user(id)).get(**{self.model.USERNAME_FIELD: id})
+
     def create_user(self, id, password, *args, **kwargs):
         if not id:
             raise ValueError('Users must have an identifier')
@@ -41,11 +72,10 @@ class UserManager(BaseUserManager):
         user = self.create_user(
             id,
             password=password,
+            is_superuser=True,
+            is_staff=True,
         )
-        user.is_superuser = True
         user.is_admin = True
-        user.is_staff = True
-        user.save(using=self._db)
         return user
 
 
@@ -85,21 +115,42 @@ class User(AbstractUser):
         # if user exists
         if self.name is None:
             return
-        if self._state.adding:
-            with connection.cursor() as cursor:
+        target = shard_move(self)
+        if target is not None and not kwargs.get('using'):
+            return move_to_shard(self, target, Vote.objects.filter(user=self.id))
+        using = kwargs.get('using') or router.db_for_write(User, instance=self)
+        if not uses_procedures(using):
+            adding = self._state.adding
+            super().save(*args, **{**kwargs, 'using': using})
+            if adding:
+                transaction.on_commit(partial(remember_user_shard, self.id, using), using=using)
+                if not self.is_staff:
+                    record_registration(self.district_id)
+        elif self._state.adding:
+            with connections[using].cursor() as cursor:
                 cursor.execute(
                     'EXECUTE dbo.SP_InsertEncryptedUser @id = %s, @name = %s, @birthdate = %s, @address = %s, @district_id = %s, @email = %s, @password = %s, @last_login = %s, @is_superuser = %s, @is_staff = %s, @is_active = 1',
                     [self.id, self.name, self.birthdate, self.address, self.district_id, self.email, self.password, self.last_login, self.is_superuser, self.is_staff]
                 )
+            self._state.adding = False
+            self._state.db = using
+            # Not cached until committed: a rolled back import must not leave the shard behind
+            transaction.on_commit(partial(remember_user_shard, self.id, using), using=using)
+            if not self.is_staff:
+                record_registration(self.district_id)
         else:
-            with connection.cursor() as cursor:
+            with connections[using].cursor() as cursor:
                 cursor.execute(
                     'EXECUTE dbo.SP_UpdateEncryptedUser @id = %s, @name = %s, @birthdate = %s, @address = %s, @district_id = %s, @email = %s, @password = %s, @last_login = %s, @is_superuser = %s, @is_staff = %s, @is_active = 1',
                     [self.id, self.name, self.birthdate, self.address, self.district_id, self.email, self.password, self.last_login, self.is_superuser, self.is_staff]
                 )
 
     def get_voted(self):
-        with connection.cursor() as cursor:
+        # Always the primary of the voter's shard: this is read right after voting
+        using = shard_for_instance(self)
+        if not uses_procedures(using):
+            return final_votes(using).filter(user=self.id).values_list('candidate_id', flat=True).first() or False
+        with connections[using].cursor() as cursor:
             cursor.execute('EXECUTE dbo.SP_GetFinalVoteByUser @user_id = %s', [self.id])
             if cursor.description:
                 result = cursor.fetchone()
@@ -111,7 +162,9 @@ class User(AbstractUser):
     @classmethod
     def from_db(cls, db, field_names, values):
         user = super().from_db(db, field_names, values)
-        with connection.cursor() as cursor:
+        if not uses_procedures(db):
+            return user
+        with connections[db].cursor() as cursor:
             cursor.execute('EXECUTE dbo.SP_SelectDecryptedUserById @id = %s', [user.id])
             row = cursor.fetchone()
             if row:
@@ -138,6 +191,17 @@ class Term(models.Model):
         return f"{self.start.year} - {self.end.year}"
 
 
+class CandidateManager(models.Manager):
+    def on_shard_of(self, district_id):
+        queryset = self.get_queryset()
+        if is_sharded():
+            queryset = queryset.using(district_shard(district_id))
+        return queryset
+
+    def in_district(self, district_id):
+        return self.on_shard_of(district_id).filter(district_id=district_id)
+
+
 class Candidate(models.Model):
     _id = models.AutoField(primary_key=True)
     id = models.CharField(max_length=40, unique=True)
@@ -148,21 +212,38 @@ class Candidate(models.Model):
     description = models.TextField(null=True, blank=True)
     term = models.ForeignKey(Term, on_delete=models.CASCADE)
 
+    objects = CandidateManager()
+
     def __str__(self):
         return f"{self.name} - {self.district}"
 
+    def save(self, *args, **kwargs):
+        target = shard_move(self)
+        if target is not None and not kwargs.get('using'):
+            return move_to_shard(self, target, Vote.objects.filter(candidate_id=self.id))
+        super().save(*args, **kwargs)
+
     def image_tag(self):
         return mark_safe('<img src="/media/%s" width="150" style="max-height: 200px;object-fit: cover;" />' % self.image)
 
-    @admin.display(description="Votes")
     def get_vote_count(self):
-        with connection.cursor() as cursor:
+        using = router.db_for_read(Vote, instance=self)
+        if not uses_procedures(using):
+            return final_votes(using).filter(candidate_id=self.id).count()
+        with connections[using].cursor() as cursor:
             cursor.execute('EXECUTE dbo.SP_CountFinalVotesByCandidate @candidate_id = %s', [self.id])
             if cursor.description:
                 return cursor.fetchone()[0]
         return 0
 
     image_tag.short_description = 'Image'
+    get_vote_count.short_description = 'Votes'
+
+
+def final_votes(using):
+    """Each voter's latest vote, for databases without the stored procedures."""
+    latest = Vote.objects.using(using).filter(user=OuterRef('user')).order_by('-timestamp', '-pk').values('pk')[:1]
+    return Vote.objects.using(using).filter(pk=Subquery(latest))
 
 
 class Vote(models.Model):
@@ -177,12 +258,88 @@ class Vote(models.Model):
         return Vote.objects.filter(candidate=self.candidate).count()
 
     def cast_vote(self):
-        with connection.cursor() as cursor:
-            cursor.execute('use VOTE; EXECUTE dbo.SP_InsertEncryptedVote @user = %s, @candidate_id = %s', [self.user, self.candidate.id])
-
-        User.objects.filter(id=self.user).update(voted=True)
+        """Inserts the vote and marks the voter in one transaction and one round trip.
+
+        Deadlocks and serialization failures are retried with jittered backoff.
+        Returns True when this is the voter's first ballot.
+        """
+        pin_to_primary()
+        using = router.db_for_write(Vote, instance=self)
+        attempts = getattr(settings, 'VOTE_CAST_ATTEMPTS', 3)
+        delay = getattr(settings, 'VOTE_CAST_RETRY_DELAY', 0.05)
+        for attempt in range(1, attempts + 1):
+            try:
+                first_vote = self._insert_and_mark(using)
+                break
+            except DatabaseError as e:
+                if attempt == attempts or not is_retryable_error(e):
+                    raise
+                time.sleep(random.uniform(0, delay * 2 ** (attempt - 1)))
+
+        bump_ballot_version(self.user)
+        if first_vote:
+            record_vote(self.candidate.district_id)
+        return first_vote
+
+    def _insert_and_mark(self, using):
+        if not uses_procedures(using):
+            with transaction.atomic(using=using):
+                super().save(using=using)
+                return bool(User._base_manager.using(using).filter(pk=self.user, voted=False).update(voted=True))
+
+        user_table = connections[using].ops.quote_name(User._meta.db_table)
+        # Run through sp_executesql so that, as in a stored procedure, the SET
+        # options end with the batch instead of sticking to the connection
+        batch = (
+            'SET NOCOUNT ON; SET XACT_ABORT ON; '
+            'DECLARE @first_vote int; '
+            'BEGIN TRANSACTION; '
+            'EXECUTE dbo.SP_InsertEncryptedVote @user = @user, @candidate_id = @candidate_id; '
+            f'UPDATE {user_table} SET voted = 1 WHERE id = @user AND voted = 0; '
+            'SET @first_vote = @@ROWCOUNT; '
+            'COMMIT TRANSACTION; '
+            'SELECT @first_vote;'
+        )
+        with connections[using].cursor() as cursor:
+            cursor.execute(
+                'EXECUTE sp_executesql %s, %s, @user = %s, @candidate_id = %s',
+                [batch, '@user nvarchar(4000), @candidate_id nvarchar(40)', self.user, self.candidate.id],
+            )
+            # SELECT @first_vote is the last result set; the procedure may return its own before it
+            row = None
+            while True:
+                if cursor.description:
+                    row = cursor.fetchone()
+                if not cursor.nextset():
+                    break
+        return bool(row and row[0])
 
     def save(self, *args, **kwargs):
         # # # TODO: add encryption here
         # super().save(*args, **kwargs)
         pass
+
+
+class TurnoutCounter(models.Model):
+    """Eligible voters and voters who have voted, per district and term.
+
+    Maintained incrementally by ``vote.turnout`` and rebuilt by the
+    ``reconcile_turnout`` command.
+    """
+    district = models.ForeignKey(District, on_delete=models.CASCADE)
+    term = models.ForeignKey(Term, on_delete=models.CASCADE)
+    eligible = models.IntegerField(default=0)
+    voted = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('district', 'term')
+
+    def __str__(self):
+        return f"{self.district} ({self.term}): {self.voted}/{self.eligible}"
+
+    @property
+    def turnout(self):
+        if not self.eligible:
+            return 0
+        return round(self.voted * 100 / self.eligible, 1)
@@ -0,0 +1,99 @@
+from django.core.cache import cache
+from django.db import connections
+from django.template.loader import get_template
+from django.urls import get_resolver
+
+from .forms import ChangePasswordForm, LoginForm, RegisterForm
+from .models import Candidate, District
+from .versions import candidates_version
+
+# Templates rendered for voters; parsing them once per worker fills the cached loader
+VOTER_TEMPLATES = (
+    'vote/master.html',
+    'vote/index.html',
+    'vote/login.html',
+    'vote/register.html',
+    'vote/candidate_detail.html',
+    'vote/change_password.html',
+)
+
+# The version in the key invalidates these on the host where the change was made.
+# Version tokens live in each host's own cache, so other hosts only pick up a
+# change when the entry expires: keep this short unless a single host serves the
+# election (see CACHES in settings.py).
+PRELOAD_TIMEOUT = 5 * 60
+
+
+def districts_key():
+    return f"vote:districts:{candidates_version()}"
+
+
+def candidates_key(district_id):
+    return f"vote:candidates:{district_id}:{candidates_version(district_id)}"
+
+
+def districts():
+    """Returns every District by primary key, cached until any candidate, district or term changes."""
+    key = districts_key()
+    found = cache.get(key)
+    if found is None:
+        found = {district.pk: district for district in District.objects.all()}
+        cache.set(key, found, timeout=PRELOAD_TIMEOUT)
+    return found
+
+
+def candidates_in_district(district_id):
+    """Returns the candidates of a district as a list, cached until one of them changes."""
+    key = candidates_key(district_id)
+    found = cache.get(key)
+    if found is None:
+        found = list(Candidate.objects.in_district(district_id))
+        by_pk = districts()
+        for candidate in found:
+            # Reference data is identical on every shard, so no join is needed
+            if candidate.district_id in by_pk:
+                candidate.district = by_pk[candidate.district_id]
+        cache.set(key, found, timeout=PRELOAD_TIMEOUT)
+    return found
+
+
+def compile_templates():
+    for name in VOTER_TEMPLATES:
+        get_template(name)
+    # Forms render through their own engine: vote/form_snippet.html and the widget templates
+    for form_class in (LoginForm, RegisterForm, ChangePasswordForm):
+        str(form_class())
+
+
+def warm_up():
+    """Prepares a worker before it accepts traffic and returns what was loaded.
+
+    Imports the views through the URLconf, fills the shared cache with the
+    districts and per-district candidate lists, and compiles the voter
+    templates. Only entries the cache actually kept are counted; districts
+    whose candidate list it refused (too large for a slot) are listed under
+    'skipped' and are read from the database on every request. Connections
+    opened on the way are closed, so this is safe to run in a master process
+    before it forks workers.
+    """
+    candidates = 0
+    skipped = []
+    try:
+        get_resolver().url_patterns
+        loaded = districts()
+        for district_id in loaded:
+            in_district = len(candidates_in_district(district_id))
+            if cache.has_key(candidates_key(district_id)):
+                candidates += in_district
+            else:
+                skipped.append(district_id)
+        compile_templates()
+        stored = cache.has_key(districts_key())
+    finally:
+        connections.close_all()
+    return {
+        'districts': len(loaded) if stored else 0,
+        'candidates': candidates,
+        'skipped': skipped,
+        'templates': len(VOTER_TEMPLATES),
+    }
@@ -0,0 +1,140 @@
+import logging
+import os
+import random
+import re
+import sys
+import threading
+from collections import Counter
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+logger = logging.getLogger(__name__)
+
+
+def _frame_label(frame):
+    module = frame.f_globals.get('__name__', '?')
+    return f"{module}:{frame.f_code.co_name}"
+
+
+def collapse_stack(frame):
+    """Render a frame chain as a root-first ``a;b;c`` collapsed stack."""
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    labels.reverse()
+    return ';'.join(labels)
+
+
+class StackSampler(threading.Thread):
+    """Periodically captures the stack of one thread until stopped."""
+
+    def __init__(self, thread_id, interval):
+        super().__init__(name=f"vote-profiler-{thread_id}", daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                break
+            self.stacks[collapse_stack(frame)] += 1
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+        return self.stacks
+
+
+class CollapsedStackWriter:
+    """Appends collapsed stacks to one rotating ``<view>.folded`` file per view.
+
+    The files are in the format consumed by ``flamegraph.pl`` and speedscope;
+    identical stacks written by different requests are summed by those tools.
+    """
+
+    def __init__(self, directory, max_bytes, backup_count):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self._lock = threading.Lock()
+
+    def path_for(self, view_name):
+        safe_name = re.sub(r'[^A-Za-z0-9_.-]', '.', view_name)
+        return os.path.join(self.directory, f"{safe_name}.folded")
+
+    def write(self, view_name, stacks):
+        if not stacks:
+            return
+        data = ''.join(f"{stack} {count}\n" for stack, count in stacks.items())
+        path = self.path_for(view_name)
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            if self.max_bytes and os.path.exists(path) and os.path.getsize(path) + len(data) > self.max_bytes:
+                self._rotate(path)
+            with open(path, 'a', encoding='utf-8') as f:
+                f.write(data)
+
+    def _rotate(self, path):
+        if self.backup_count <= 0:
+            os.remove(path)
+            return
+        for i in range(self.backup_count - 1, 0, -1):
+            source = f"{path}.{i}"
+            if os.path.exists(source):
+                os.replace(source, f"{path}.{i + 1}")
+        os.replace(path, f"{path}.1")
+
+
+class SamplingProfilerMiddleware:
+    """Samples the stack of a fraction of requests and writes per-view flame graphs.
+
+    A request is profiled when it is picked by ``VOTE_PROFILER_SAMPLE_RATE`` or
+    when a staff user sends the ``VOTE_PROFILER_HEADER`` header. Must be placed
+    after ``AuthenticationMiddleware``.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'VOTE_PROFILER_ENABLED', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, 'VOTE_PROFILER_SAMPLE_RATE', 0.0)
+        self.header = getattr(settings, 'VOTE_PROFILER_HEADER', 'X-Vote-Profile')
+        self.interval = getattr(settings, 'VOTE_PROFILER_INTERVAL', 0.005)
+        self.writer = CollapsedStackWriter(
+            getattr(settings, 'VOTE_PROFILER_DIR', os.path.join(settings.BASE_DIR, 'profiles')),
+            getattr(settings, 'VOTE_PROFILER_MAX_BYTES', 10 * 1024 * 1024),
+            getattr(settings, 'VOTE_PROFILER_BACKUP_COUNT', 5),
+        )
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        sampler = getattr(request, '_vote_profiler', None)
+        if sampler is not None:
+            stacks = sampler.stop()
+            try:
+                self.writer.write(request._vote_profiler_view, stacks)
+            except OSError:
+                # e.g. another worker rotated the file under us; never fail the request
+                logger.warning("Could not write profile of %s", request._vote_profiler_view, exc_info=True)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if not self.should_profile(request):
+            return None
+        sampler = StackSampler(threading.get_ident(), self.interval)
+        request._vote_profiler = sampler
+        request._vote_profiler_view = request.resolver_match.view_name or view_func.__qualname__
+        sampler.start()
+        return None
+
+    def should_profile(self, request):
+        if self.sample_rate and random.random() < self.sample_rate:
+            return True
+        if self.header and request.headers.get(self.header):
+            return request.user.is_staff
+        return False
@@ -0,0 +1,169 @@
+import random
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+from .sharding import SHARDED_MODELS, is_sharded, shard_for_instance
+
+# Set once the current request has written to the primary; later reads in the
+# same request then see their own writes.
+_pinned = ContextVar('vote_db_pinned', default=False)
+
+# Apps whose tables are always read from the primary.
+PRIMARY_ONLY_APPS = {'sessions'}
+
+PIN_SESSION_KEY = '_db_pinned_until'
+
+
+def has_replicas():
+    return bool(getattr(settings, 'DATABASE_REPLICAS', None))
+
+
+def pin_to_primary():
+    # Without replicas every read already goes to the primary
+    if has_replicas():
+        _pinned.set(True)
+
+
+def is_pinned():
+    return _pinned.get()
+
+
+class ShardRouter:
+    """Sends users, candidates and votes to the shard owning their district.
+
+    Only queries that carry an instance hint (saves, related lookups) can be
+    routed here; querysets are pointed at a shard with ``.using()``, see
+    ``Candidate.objects.in_district``. Everything else falls through to the
+    next router. Saved rows stay where they were loaded from; a change of
+    district to another shard is handled by the models, see ``move_to_shard``.
+    """
+
+    def db_for_read(self, model, **hints):
+        return self._route(model, hints)
+
+    def db_for_write(self, model, **hints):
+        alias = self._route(model, hints)
+        if alias is not None:
+            pin_to_primary()
+        return alias
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def _route(self, model, hints):
+        if not is_sharded() or model._meta.app_label != 'vote' or model._meta.model_name not in SHARDED_MODELS:
+            return None
+        instance = hints.get('instance')
+        if instance is None:
+            return None
+        # New rows go by district; _state.db of an unsaved instance is only
+        # inherited from whatever related object was assigned to it
+        if instance._state.adding and instance._meta.model_name in SHARDED_MODELS:
+            return shard_for_instance(instance)
+        return instance._state.db
+
+
+class ReplicaRouter:
+    """Routes reads to the replicas in ``DATABASE_REPLICAS`` and writes to the primary.
+
+    A replica is skipped while it is unreachable or lags behind by more than
+    ``DATABASE_REPLICA_MAX_LAG`` seconds, as measured by
+    ``DATABASE_REPLICA_LAG_QUERY``. Reads fall back to the primary when no
+    replica is usable or when the request is pinned after a write. Settings
+    are read on every call, so they can be overridden in tests.
+    """
+
+    def __init__(self):
+        self._health = {}
+
+    @property
+    def replicas(self):
+        return list(getattr(settings, 'DATABASE_REPLICAS', []))
+
+    @property
+    def max_lag(self):
+        return getattr(settings, 'DATABASE_REPLICA_MAX_LAG', 5)
+
+    @property
+    def lag_query(self):
+        return getattr(settings, 'DATABASE_REPLICA_LAG_QUERY', None) or 'SELECT 0'
+
+    @property
+    def check_interval(self):
+        return getattr(settings, 'DATABASE_REPLICA_CHECK_INTERVAL', 10)
+
+    def db_for_read(self, model, **hints):
+        replicas = self.replicas
+        if not replicas or is_pinned() or model._meta.app_label in PRIMARY_ONLY_APPS:
+            return DEFAULT_DB_ALIAS
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            return instance._state.db
+        healthy = [alias for alias in replicas if self.is_healthy(alias)]
+        if not healthy:
+            return DEFAULT_DB_ALIAS
+        return random.choice(healthy)
+
+    def db_for_write(self, model, **hints):
+        if model._meta.app_label not in PRIMARY_ONLY_APPS:
+            pin_to_primary()
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in self.replicas:
+            return False
+        return None
+
+    def is_healthy(self, alias):
+        now = time.monotonic()
+        checked = self._health.get(alias)
+        if checked is not None and now - checked[0] < self.check_interval:
+            return checked[1]
+        lag = self.replica_lag(alias)
+        healthy = lag is not None and lag <= self.max_lag
+        self._health[alias] = (now, healthy)
+        return healthy
+
+    def replica_lag(self, alias):
+        try:
+            with connections[alias].cursor() as cursor:
+                cursor.execute(self.lag_query)
+                row = cursor.fetchone()
+        except DatabaseError:
+            return None
+        if row is None or row[0] is None:
+            return None
+        return row[0]
+
+
+class PrimaryPinningMiddleware:
+    """Keeps a session on the primary for ``DATABASE_PIN_SECONDS`` after it writes.
+
+    This covers read-your-own-write across the redirect that follows a POST,
+    e.g. the ballot page right after ``cast_vote``. Must be placed after
+    ``SessionMiddleware``. Unused when no replicas are configured, so writes
+    do not also rewrite the session.
+    """
+
+    def __init__(self, get_response):
+        if not has_replicas():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.pin_seconds = getattr(settings, 'DATABASE_PIN_SECONDS', 5)
+
+    def __call__(self, request):
+        token = _pinned.set(request.session.get(PIN_SESSION_KEY, 0) > time.time())
+        try:
+            response = self.get_response(request)
+            if is_pinned() and request.method not in ('GET', 'HEAD'):
+                request.session[PIN_SESSION_KEY] = time.time() + self.pin_seconds
+        finally:
+            _pinned.reset(token)
+        return response
@@ -0,0 +1,128 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+# Models whose rows live on the shard that owns their district. District and
+# Term are reference data present on every shard.
+SHARDED_MODELS = ('user', 'candidate', 'vote')
+
+
+def is_sharded():
+    return bool(getattr(settings, 'DISTRICT_SHARDS', None))
+
+
+def default_shard():
+    return getattr(settings, 'DISTRICT_SHARD_DEFAULT', DEFAULT_DB_ALIAS)
+
+
+def shards():
+    aliases = [default_shard()] + list(getattr(settings, 'DISTRICT_SHARDS', {}).values())
+    return list(dict.fromkeys(aliases))
+
+
+def district_shard(district_id):
+    if not is_sharded() or district_id is None:
+        return default_shard()
+    try:
+        district_id = int(district_id)
+    except (TypeError, ValueError):
+        pass
+    return settings.DISTRICT_SHARDS.get(district_id, default_shard())
+
+
+def shard_for_instance(instance):
+    if instance._meta.model_name == 'vote':
+        return district_shard(instance.candidate.district_id)
+    return district_shard(instance.district_id)
+
+
+def shard_move(instance):
+    """Returns the shard a saved row must move to because its district is now on another one, or None."""
+    if not is_sharded() or instance._state.adding or instance._state.db is None:
+        return None
+    target = shard_for_instance(instance)
+    return target if target != instance._state.db else None
+
+
+def move_to_shard(instance, target, history):
+    """Moves a saved user or candidate to ``target`` after a change of district.
+
+    The row is deleted on its old shard and inserted on the new one inside
+    atomic blocks on both. The new shard commits first: should the old one
+    then fail, the row is briefly on both rather than on neither, and saving
+    it again completes the move. Rows with votes in ``history`` are refused,
+    as the votes cannot follow them.
+    """
+    source = instance._state.db
+    if history.using(source).exists():
+        raise ValueError(f"{instance} has votes on '{source}' and cannot move to a district on '{target}'.")
+    model = type(instance)
+    pk = instance.pk
+    try:
+        with transaction.atomic(using=source), transaction.atomic(using=target):
+            model._base_manager.using(source).filter(id=instance.id).delete()
+            # Left behind by an earlier move whose old shard failed to commit
+            model._base_manager.using(target).filter(id=instance.id).delete()
+            instance._state.adding = True
+            instance._state.db = None
+            if model._meta.auto_field:
+                # Surrogate keys are per shard
+                instance.pk = None
+            instance.save(using=target, force_insert=True)
+    except Exception:
+        instance._state.adding = False
+        instance._state.db = source
+        instance.pk = pk
+        raise
+
+
+def scatter_gather(func, aliases=None):
+    """Calls ``func(alias)`` on every shard in parallel and returns the results in shard order."""
+    aliases = list(aliases or shards())
+    # Pool threads have their own connections and would not see this thread's uncommitted writes
+    if len(aliases) == 1 or any(connections[alias].in_atomic_block for alias in aliases):
+        return [func(alias) for alias in aliases]
+
+    def run(alias):
+        try:
+            return func(alias)
+        finally:
+            # Connections are per thread; do not leak the pool thread's one
+            connections[alias].close()
+
+    with ThreadPoolExecutor(max_workers=len(aliases)) as pool:
+        return list(pool.map(run, aliases))
+
+
+def _user_shard_key(user_id):
+    return f"vote:user-shard:{user_id}"
+
+
+def remember_user_shard(user_id, alias):
+    if is_sharded():
+        cache.set(_user_shard_key(user_id), alias, timeout=None)
+
+
+def locate_user(user_id):
+    """Returns the shard holding ``user_id``, or None when not sharded or unknown."""
+    if not is_sharded():
+        return None
+    alias = cache.get(_user_shard_key(user_id))
+    if alias is not None:
+        return alias
+    from .models import User
+    found = scatter_gather(lambda alias: User.objects.using(alias).filter(pk=user_id).exists())
+    for alias, exists in zip(shards(), found):
+        if exists:
+            remember_user_shard(user_id, alias)
+            return alias
+    return None
+
+
+def user_exists(user_id):
+    from .models import User
+    if is_sharded():
+        return locate_user(user_id) is not None
+    return User.objects.filter(pk=user_id).exists()
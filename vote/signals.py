@@ -0,0 +1,63 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .models import Candidate, District, Term, User
+from .sharding import default_shard, is_sharded, shards
+from .turnout import record_unregistration
+from .versions import bump_candidates_version
+
+
+@receiver(pre_save, sender=Candidate)
+def candidate_moving(sender, instance, using, raw=False, **kwargs):
+    # A candidate moved to another district must also disappear from the old one
+    if not raw and instance.pk is not None:
+        # The row is on the shard being written to, not wherever an unhinted read would go
+        previous = sender._base_manager.using(using).filter(pk=instance.pk).values_list('district_id', flat=True).first()
+        if previous is not None and previous != instance.district_id:
+            bump_candidates_version(previous)
+
+
+@receiver(post_save, sender=Candidate)
+@receiver(post_delete, sender=Candidate)
+def candidate_changed(sender, instance, **kwargs):
+    bump_candidates_version(instance.district_id)
+
+
+@receiver(post_save, sender=District)
+@receiver(post_delete, sender=District)
+def district_changed(sender, instance, **kwargs):
+    bump_candidates_version(instance.pk)
+
+
+@receiver(post_save, sender=Term)
+@receiver(post_delete, sender=Term)
+def term_changed(sender, instance, **kwargs):
+    bump_candidates_version()
+
+
+@receiver(post_save, sender=District)
+@receiver(post_save, sender=Term)
+def replicate_reference_data(sender, instance, using, raw=False, **kwargs):
+    # Reference data is edited on the default shard and copied to the others
+    if raw or not is_sharded() or using != default_shard():
+        return
+    values = {field.attname: getattr(instance, field.attname) for field in sender._meta.concrete_fields if not field.primary_key}
+    for alias in shards():
+        if alias != using:
+            sender._base_manager.using(alias).update_or_create(pk=instance.pk, defaults=values)
+
+
+@receiver(post_delete, sender=District)
+@receiver(post_delete, sender=Term)
+def delete_replicated_reference_data(sender, instance, using, **kwargs):
+    if not is_sharded() or using != default_shard():
+        return
+    for alias in shards():
+        if alias != using:
+            sender._base_manager.using(alias).filter(pk=instance.pk).delete()
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    if not instance.is_staff:
+        record_unregistration(instance.district_id, instance.voted)
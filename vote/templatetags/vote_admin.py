@@ -0,0 +1,13 @@
+from django import template
+
+from vote.turnout import turnout_for
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def turnout_counters(context):
+    request = context.get('request')
+    if request is None or not request.user.is_staff:
+        return []
+    return list(turnout_for(request.user))
@@ -1,3 +1,514 @@
-from django.test import TestCase
+import datetime
+import os
+import sys
+import tempfile
+import threading
+from unittest import mock
 
-# Create your tests here.
+import tablib
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured, MiddlewareNotUsed
+from django.db import DatabaseError, router
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import resolve, reverse
+
+from .admin import UserResource
+from .cache import SharedMemoryCache, _shared_files
+from .models import Candidate, District, Term, TurnoutCounter, User, Vote, is_retryable_error
+from .preload import warm_up
+from .profiling import SamplingProfilerMiddleware
+from .routers import PIN_SESSION_KEY, PrimaryPinningMiddleware, _pinned, is_pinned, pin_to_primary
+from .sharding import _user_shard_key, locate_user
+from .turnout import reconcile_turnout
+from .validation import parse_date, validate_voter_roll
+from .versions import candidates_version
+
+
+class SharedMemoryCacheTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'test.mmap')
+        self.params = {'OPTIONS': {'MAX_SIZE': 512 * 1024, 'SLOT_SIZES': [512, 4096, 32768], 'WAYS': 4}}
+
+    def make_cache(self):
+        return SharedMemoryCache(self.path, self.params)
+
+    def test_set_get_delete(self):
+        cache = self.make_cache()
+        cache.set('key', {'a': 1})
+        self.assertEqual(cache.get('key'), {'a': 1})
+        self.assertFalse(cache.add('key', 'other'))
+        self.assertTrue(cache.delete('key'))
+        self.assertIsNone(cache.get('key'))
+
+    def test_values_go_to_the_smallest_fitting_class(self):
+        cache = self.make_cache()
+        small, large = 'token', list(range(5000))
+        cache.set('small', small)
+        cache.set('large', large)
+        self.assertEqual(cache.get('small'), small)
+        self.assertEqual(cache.get('large'), large)
+
+        # Growing and shrinking moves the value between classes without leaving the old copy
+        cache.set('small', large)
+        self.assertEqual(cache.get('small'), large)
+        cache.set('small', small)
+        self.assertEqual(cache.get('small'), small)
+        self.assertTrue(cache.delete('small'))
+        self.assertIsNone(cache.get('small'))
+
+    def test_values_larger_than_every_slot_are_not_cached(self):
+        cache = self.make_cache()
+        cache.set('key', 'old')
+        with self.assertLogs('vote.cache', 'WARNING'):
+            self.assertFalse(cache.set('key', os.urandom(40000)))
+        self.assertIsNone(cache.get('key'))
+
+    def test_small_entries_do_not_use_large_slots(self):
+        # 512 small slots and only 8 large ones
+        cache = SharedMemoryCache(self.path, {'OPTIONS': {'MAX_SIZE': 512 * 1024, 'SLOT_SIZES': [512, 32768]}})
+        for n in range(200):
+            cache.set(f"ballot:{n}", f"{n:012x}")
+        self.assertGreater(sum(cache.get(f"ballot:{n}") is not None for n in range(200)), 150)
+
+    def test_instances_share_entries(self):
+        self.make_cache().set('key', 'value')
+        self.assertEqual(self.make_cache().get('key'), 'value')
+
+    def test_reopening_the_file_keeps_entries(self):
+        # As a freshly started worker process would
+        self.make_cache().set('key', 'value')
+        _shared_files.pop((self.path, os.getpid())).close()
+        self.assertEqual(self.make_cache().get('key'), 'value')
+
+    def test_other_options_do_not_reset_the_file(self):
+        self.make_cache().set('key', 'value')
+        _shared_files.pop((self.path, os.getpid())).close()
+        other = SharedMemoryCache(self.path, {'OPTIONS': {**self.params['OPTIONS'], 'MAX_SIZE': 256 * 1024}})
+
+        with self.assertRaises(ImproperlyConfigured):
+            other.get('key')
+        self.assertEqual(self.make_cache().get('key'), 'value')
+
+    def test_stripe_excludes_other_instances_in_process(self):
+        holder, waiter = self.make_cache(), self.make_cache()
+        acquired = threading.Event()
+
+        def lock_stripe():
+            with waiter._locked(0, 0):
+                acquired.set()
+
+        with holder._locked(0, 0):
+            thread = threading.Thread(target=lock_stripe)
+            thread.start()
+            self.assertFalse(acquired.wait(0.2))
+        thread.join()
+        self.assertTrue(acquired.is_set())
+
+    def test_threads_with_own_instances(self):
+        # Django's cache handler gives each thread its own backend instance
+        errors = []
+        # Different lengths, so a read racing a write sees a header and body that do not match
+        values = [list(range(n * 150)) for n in range(1, 5)]
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        self.addCleanup(sys.setswitchinterval, interval)
+
+        def hammer(value):
+            cache = self.make_cache()
+            try:
+                for _ in range(2000):
+                    cache.set('shared', value)
+                    # A value moving to another size class may be missed, never torn
+                    value = cache.get('shared')
+                    if value is not None and value not in values:
+                        errors.append('torn read')
+                cache.add('counter', 0)
+                for _ in range(250):
+                    cache.incr('counter')
+            except Exception as e:
+                errors.append(repr(e))
+
+        threads = [threading.Thread(target=hammer, args=(value,)) for value in values]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(self.make_cache().get('counter'), 1000)
+
+
+@override_settings(DISTRICT_SHARDS={1: 'default', 2: 'shard1'})
+class ShardingTests(TestCase):
+    databases = {'default', 'shard1'}
+
+    def setUp(self):
+        cache.clear()
+        self.home = District.objects.create(short_name='D1', long_name='District 1')
+        self.remote = District.objects.create(short_name='D2', long_name='District 2')
+        self.term = Term.objects.create(start=datetime.date(2025, 1, 1), end=datetime.date(2030, 1, 1))
+
+    def make_candidate(self, id, district):
+        candidate = Candidate(id=id, name=f"Candidate {id}", district=district, term=self.term)
+        candidate.save()
+        return candidate
+
+    def test_reference_data_is_replicated(self):
+        self.assertEqual(District.objects.using('shard1').count(), 2)
+        self.assertTrue(Term.objects.using('shard1').filter(pk=self.term.pk).exists())
+
+    def test_rows_go_to_their_district_shard(self):
+        with self.captureOnCommitCallbacks(using='shard1', execute=True):
+            user = User.objects.create_user('V-200', 'secret', name='Remote voter', district=self.remote)
+        candidate = self.make_candidate('C-200', self.remote)
+
+        self.assertTrue(User.objects.using('shard1').filter(pk=user.pk).exists())
+        self.assertFalse(User.objects.using('default').filter(pk=user.pk).exists())
+        self.assertTrue(Candidate.objects.using('shard1').filter(id=candidate.id).exists())
+        self.assertEqual(locate_user(user.pk), 'shard1')
+        self.assertEqual(User.objects.get_by_natural_key('V-200').name, 'Remote voter')
+        self.assertEqual(list(Candidate.objects.in_district(self.remote.pk)), [candidate])
+        self.assertEqual(list(Candidate.objects.in_district(self.home.pk)), [])
+
+    def test_moving_candidate_moves_it_to_the_new_shard(self):
+        candidate = self.make_candidate('C-202', self.remote)
+        version = candidates_version(self.remote.pk)
+
+        candidate.district = self.home
+        candidate.save()
+
+        self.assertEqual(list(Candidate.objects.in_district(self.home.pk)), [candidate])
+        self.assertEqual(list(Candidate.objects.in_district(self.remote.pk)), [])
+        self.assertFalse(Candidate.objects.using('shard1').filter(id='C-202').exists())
+        self.assertNotEqual(candidates_version(self.remote.pk), version)
+
+    def test_candidate_with_votes_does_not_move(self):
+        user = User.objects.create_user('V-203', 'secret', name='Remote voter', district=self.remote)
+        candidate = self.make_candidate('C-203', self.remote)
+        Vote(candidate=candidate, user=user.pk).cast_vote()
+
+        candidate.district = self.home
+        with self.assertRaises(ValueError):
+            candidate.save()
+
+        self.assertEqual(candidate._state.db, 'shard1')
+        self.assertEqual(Candidate.objects.using('shard1').get(id='C-203').district_id, self.remote.pk)
+
+    def test_moving_voter_moves_them_to_the_new_shard(self):
+        with self.captureOnCommitCallbacks(using='shard1', execute=True):
+            user = User.objects.create_user('V-204', 'secret', name='Moving voter', district=self.remote)
+        candidate = self.make_candidate('C-204', self.home)
+
+        user.district = self.home
+        with self.captureOnCommitCallbacks(using='default', execute=True):
+            user.save()
+
+        self.assertEqual(locate_user(user.pk), 'default')
+        self.assertFalse(User.objects.using('shard1').filter(pk=user.pk).exists())
+        self.assertTrue(Vote(candidate=candidate, user=user.pk).cast_vote())
+        self.assertTrue(User.objects.using('default').get(pk=user.pk).voted)
+        counters = dict(TurnoutCounter.objects.values_list('district_id', 'eligible'))
+        self.assertEqual(counters, {self.home.pk: 1, self.remote.pk: 0})
+
+    def test_cast_vote_on_voter_shard(self):
+        user = User.objects.create_user('V-201', 'secret', name='Remote voter', district=self.remote)
+        candidate = self.make_candidate('C-201', self.remote)
+
+        self.assertTrue(Vote(candidate=candidate, user=user.pk).cast_vote())
+        self.assertFalse(Vote(candidate=candidate, user=user.pk).cast_vote())
+        self.assertTrue(User.objects.using('shard1').get(pk=user.pk).voted)
+        self.assertEqual(user.get_voted(), candidate.id)
+        self.assertEqual(candidate.get_vote_count(), 1)
+        self.assertFalse(Vote.objects.using('default').exists())
+
+    @mock.patch('vote.validation.MAX_IN_PARAMS', 2)
+    def test_roll_reports_voters_registered_on_any_shard(self):
+        User.objects.create_user('V-302', 'secret', name='Home voter', district=self.home)
+        User.objects.create_user('V-303', 'secret', name='Remote voter', district=self.remote)
+        dataset = tablib.Dataset(headers=['id', 'name', 'email', 'district', 'birthdate', 'address'])
+        for id in ('V-302', 'V-303', 'V-304', 'V-305', 'V-306'):
+            dataset.append([id, 'Voter', f"{id}@example.vn", self.home.pk, '2000-01-01', 'Street 1'])
+
+        # Districts, then the five ids in chunks of two on each shard
+        with self.assertNumQueries(4, using='default'), self.assertNumQueries(3, using='shard1'):
+            report = validate_voter_roll(dataset)
+
+        self.assertEqual(sorted(report.row_errors), [1, 2])
+        self.assertIn('already registered', report.errors_for(2)['id'][0])
+
+    def test_import_dry_run_leaves_no_rows_on_any_shard(self):
+        dataset = tablib.Dataset(headers=['id', 'name', 'email', 'district', 'birthdate', 'address'])
+        dataset.append(['V-300', 'Home voter', 'v300@example.vn', self.home.pk, '2000-01-01', 'Street 1'])
+        dataset.append(['V-301', 'Remote voter', 'v301@example.vn', self.remote.pk, '2000-01-01', 'Street 2'])
+
+        with self.captureOnCommitCallbacks(using='shard1', execute=True) as callbacks:
+            result = UserResource().import_data(dataset, dry_run=True)
+
+        self.assertFalse(result.has_errors())
+        self.assertEqual(result.totals['new'], 2)
+        self.assertFalse(User.objects.using('default').filter(pk='V-300').exists())
+        self.assertFalse(User.objects.using('shard1').filter(pk='V-301').exists())
+        self.assertEqual(callbacks, [])
+        self.assertIsNone(cache.get(_user_shard_key('V-301')))
+        self.assertFalse(TurnoutCounter.objects.filter(eligible__gt=0).exists())
+
+
+class PreloadTests(TransactionTestCase):
+    # warm_up() closes connections, which a TestCase transaction would not survive
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        caches = override_settings(CACHES={'default': {
+            'BACKEND': 'vote.cache.SharedMemoryCache',
+            'LOCATION': os.path.join(directory.name, 'default.mmap'),
+            'OPTIONS': {'MAX_SIZE': 256 * 1024, 'SLOT_SIZES': [4096]},
+        }})
+        caches.enable()
+        self.addCleanup(caches.disable)
+
+    def test_only_stored_entries_are_counted(self):
+        small = District.objects.create(short_name='D1', long_name='District 1')
+        large = District.objects.create(short_name='D2', long_name='District 2')
+        term = Term.objects.create(start=datetime.date(2025, 1, 1), end=datetime.date(2030, 1, 1))
+        Candidate(id='C-500', name='Candidate', district=small, term=term).save()
+        for number in range(10):
+            Candidate(id=f"C-6{number:02}", name='Candidate', district=large, term=term,
+                      description='x' * 1000).save()
+
+        with self.assertLogs('vote.cache', 'WARNING'):
+            loaded = warm_up()
+
+        self.assertEqual(loaded['districts'], 2)
+        self.assertEqual(loaded['candidates'], 1)
+        self.assertEqual(loaded['skipped'], [large.pk])
+
+
+class ETagTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        district = District.objects.create(short_name='D1', long_name='District 1')
+        term = Term.objects.create(start=datetime.date(2025, 1, 1), end=datetime.date(2030, 1, 1))
+        self.candidate = Candidate(id='C-700', name='Candidate', district=district, term=term, image='images/c.png')
+        self.candidate.save()
+        self.user = User.objects.create_user('V-700', 'secret', name='Voter', district=district)
+        self.client.force_login(self.user)
+        self.detail_url = reverse('vote:candidate_detail', args=[self.candidate.id])
+        # The ETag covers the CSRF cookie, which the first page sets
+        self.client.get(reverse('vote:index'))
+
+    def etag(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.get('ETag')
+
+    def test_matching_etag_skips_the_view(self):
+        for url in (reverse('vote:index'), self.detail_url):
+            etag = self.etag(url)
+            with mock.patch('vote.views.render') as render:
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+            render.assert_not_called()
+
+    def test_etag_changes_after_voting(self):
+        etag = self.etag(reverse('vote:index'))
+        Vote(candidate=self.candidate, user=self.user.pk).cast_vote()
+        self.assertNotEqual(self.etag(reverse('vote:index')), etag)
+
+    def test_etag_changes_after_editing_a_candidate(self):
+        index_etag, detail_etag = self.etag(reverse('vote:index')), self.etag(self.detail_url)
+        self.candidate.name = 'Renamed'
+        self.candidate.save()
+        self.assertNotEqual(self.etag(reverse('vote:index')), index_etag)
+        self.assertNotEqual(self.etag(self.detail_url), detail_etag)
+
+    def test_no_etag_while_messages_are_pending(self):
+        self.client.post(reverse('vote:vote', args=[self.candidate.id]))
+        response = self.client.get(reverse('vote:index'))
+        self.assertContains(response, 'Bỏ phiếu thành công!')
+        self.assertFalse(response.has_header('ETag'))
+        self.assertIsNotNone(self.etag(reverse('vote:index')))
+
+
+def driver_error(*args):
+    # As Django wraps them: the driver's error, with its SQLSTATE or native code, is the cause
+    error = DatabaseError(*args)
+    error.__cause__ = Exception(*args)
+    return error
+
+
+@override_settings(VOTE_CAST_ATTEMPTS=3, VOTE_CAST_RETRY_DELAY=0)
+class CastVoteRetryTests(TestCase):
+    def setUp(self):
+        district = District.objects.create(short_name='D1', long_name='District 1')
+        term = Term.objects.create(start=datetime.date(2025, 1, 1), end=datetime.date(2030, 1, 1))
+        self.candidate = Candidate(id='C-800', name='Candidate', district=district, term=term)
+        self.candidate.save()
+        self.vote = Vote(candidate=self.candidate, user='V-800')
+
+    def test_retryable_errors(self):
+        self.assertTrue(is_retryable_error(driver_error('40001', '[40001] Serialization failure')))
+        self.assertTrue(is_retryable_error(driver_error('HY000', 'Transaction was deadlocked (1205)')))
+        self.assertFalse(is_retryable_error(driver_error('23000', 'Violation of PRIMARY KEY constraint')))
+
+    def test_gives_up_after_the_configured_attempts(self):
+        with mock.patch.object(Vote, '_insert_and_mark', side_effect=driver_error('40001', 'deadlock')) as insert:
+            with self.assertRaises(DatabaseError):
+                self.vote.cast_vote()
+        self.assertEqual(insert.call_count, 3)
+
+    def test_other_errors_are_raised_at_once(self):
+        with mock.patch.object(Vote, '_insert_and_mark', side_effect=driver_error('23000', 'constraint')) as insert:
+            with self.assertRaises(DatabaseError):
+                self.vote.cast_vote()
+        self.assertEqual(insert.call_count, 1)
+
+    def test_succeeds_after_a_transient_failure(self):
+        side_effect = [driver_error('HY000', 'deadlock victim (1205)'), True]
+        with mock.patch.object(Vote, '_insert_and_mark', side_effect=side_effect) as insert:
+            self.assertTrue(self.vote.cast_vote())
+        self.assertEqual(insert.call_count, 2)
+        self.assertEqual(TurnoutCounter.objects.get().voted, 1)
+
+
+class TurnoutTests(TestCase):
+    def setUp(self):
+        self.district = District.objects.create(short_name='D1', long_name='District 1')
+        self.term = Term.objects.create(start=datetime.date(2025, 1, 1), end=datetime.date(2030, 1, 1))
+        self.candidate = Candidate(id='C-900', name='Candidate', district=self.district, term=self.term)
+        self.candidate.save()
+
+    def counts(self):
+        counter = TurnoutCounter.objects.get(district=self.district, term=self.term)
+        return counter.eligible, counter.voted
+
+    def test_registration_and_import_count_voters(self):
+        User.objects.create_user('V-900', 'secret', name='Voter', district=self.district)
+        User.objects.create_user('V-901', 'secret', name='Staff', district=self.district, is_staff=True)
+        dataset = tablib.Dataset(headers=['id', 'name', 'email', 'district', 'birthdate', 'address'])
+        dataset.append(['V-902', 'Imported voter', 'v902@example.vn', self.district.pk, '2000-01-01', 'Street 1'])
+
+        result = UserResource().import_data(dataset)
+
+        self.assertFalse(result.has_errors())
+        self.assertEqual(self.counts(), (2, 0))
+
+    def test_only_the_first_vote_counts(self):
+        user = User.objects.create_user('V-903', 'secret', name='Voter', district=self.district)
+
+        Vote(candidate=self.candidate, user=user.pk).cast_vote()
+        Vote(candidate=self.candidate, user=user.pk).cast_vote()
+
+        self.assertEqual(self.counts(), (1, 1))
+
+    def test_deleting_a_voter_uncounts_them(self):
+        user = User.objects.create_user('V-904', 'secret', name='Voter', district=self.district)
+        User.objects.create_user('V-905', 'secret', name='Voter', district=self.district)
+        Vote(candidate=self.candidate, user=user.pk).cast_vote()
+
+        User.objects.get(pk=user.pk).delete()
+
+        self.assertEqual(self.counts(), (1, 0))
+
+    def test_reconcile_rewrites_drifted_counters(self):
+        user = User.objects.create_user('V-906', 'secret', name='Voter', district=self.district)
+        Vote(candidate=self.candidate, user=user.pk).cast_vote()
+        other = District.objects.create(short_name='D2', long_name='District 2')
+        TurnoutCounter.objects.filter(district=self.district).update(eligible=40, voted=30)
+        TurnoutCounter.objects.create(district=other, term=self.term, eligible=5, voted=1)
+
+        reconcile_turnout(self.term)
+
+        self.assertEqual(self.counts(), (1, 1))
+        self.assertFalse(TurnoutCounter.objects.filter(district=other).exists())
+
+
+class VoterRollTests(TestCase):
+    def test_birthdates_are_read_like_the_import_widget(self):
+        district = District.objects.create(short_name='D1', long_name='District 1')
+        dataset = tablib.Dataset(headers=['id', 'name', 'email', 'district', 'birthdate', 'address'])
+        dataset.append(['V-400', 'Voter', 'v400@example.vn', district.pk, '05/04/2000', 'Street 1'])
+        dataset.append(['V-401', 'Voter', 'v401@example.vn', district.pk, '2000-04-05', 'Street 2'])
+
+        report = validate_voter_roll(dataset, today=datetime.date(2025, 1, 1))
+
+        self.assertIn('birthdate', report.errors_for(1))
+        self.assertEqual(report.errors_for(2), {})
+        widget = UserResource().fields['birthdate'].widget
+        self.assertEqual(widget.clean('2000-04-05'), parse_date('2000-04-05'))
+        with self.assertRaises(ValueError):
+            widget.clean('05/04/2000')
+
+
+@override_settings(VOTE_PROFILER_ENABLED=True, VOTE_PROFILER_SAMPLE_RATE=1.0)
+class ProfilerTests(SimpleTestCase):
+    def test_write_errors_do_not_fail_the_request(self):
+        response = HttpResponse('ok')
+        middleware = SamplingProfilerMiddleware(lambda request: response)
+
+        def rotated_away(view_name, stacks):
+            raise FileNotFoundError(view_name)
+
+        middleware.writer.write = rotated_away
+        request = RequestFactory().get('/login/')
+        request.resolver_match = resolve('/login/')
+        middleware.process_view(request, request.resolver_match.func, (), {})
+
+        with self.assertLogs('vote.profiling', 'WARNING'):
+            self.assertIs(middleware(request), response)
+
+
+class PrimaryPinningTests(SimpleTestCase):
+    def pinning_view(self, request):
+        pin_to_primary()
+        return HttpResponse(str(is_pinned()))
+
+    def test_no_pinning_without_replicas(self):
+        with self.assertRaises(MiddlewareNotUsed):
+            PrimaryPinningMiddleware(self.pinning_view)
+        request = RequestFactory().post('/')
+        self.assertEqual(self.pinning_view(request).content, b'False')
+
+    @override_settings(DATABASE_REPLICAS=['replica'])
+    def test_write_pins_the_session(self):
+        request = RequestFactory().post('/')
+        request.session = {}
+        response = PrimaryPinningMiddleware(self.pinning_view)(request)
+        self.assertEqual(response.content, b'True')
+        self.assertIn(PIN_SESSION_KEY, request.session)
+        self.assertFalse(is_pinned())
+
+
+@override_settings(DATABASE_REPLICAS=['replica'], DATABASE_REPLICA_CHECK_INTERVAL=0)
+class ReplicaRouterTests(TestCase):
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        # Pinning lasts for the rest of the context, i.e. the whole test run
+        token = _pinned.set(False)
+        self.addCleanup(_pinned.reset, token)
+
+    def test_reads_go_to_the_replica(self):
+        self.assertEqual(router.db_for_read(District), 'replica')
+        self.assertEqual(router.db_for_read(Session), 'default')
+
+    @override_settings(DATABASE_REPLICA_LAG_QUERY='SELECT 60')
+    def test_lagging_replica_falls_back_to_the_primary(self):
+        self.assertEqual(router.db_for_read(District), 'default')
+
+    @override_settings(DATABASE_REPLICA_LAG_QUERY='SELECT lag FROM missing_table')
+    def test_unreachable_replica_falls_back_to_the_primary(self):
+        self.assertEqual(router.db_for_read(District), 'default')
+
+    def test_writes_and_pinned_reads_stay_on_the_primary(self):
+        self.assertEqual(router.db_for_write(District), 'default')
+        self.assertTrue(is_pinned())
+        self.assertEqual(router.db_for_read(District), 'default')
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_no_replicas(self):
+        self.assertEqual(router.db_for_read(District), 'default')
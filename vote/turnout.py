@@ -0,0 +1,84 @@
+from collections import Counter
+
+from django.db import IntegrityError, router, transaction
+from django.db.models import Count, F, Q
+from django.utils import timezone
+
+from .sharding import scatter_gather
+
+
+def current_term():
+    from .models import Term
+    today = timezone.localdate()
+    terms = Term.objects.order_by('-start')
+    return terms.filter(start__lte=today, end__gte=today).first() or terms.first()
+
+
+def _add(district_id, **deltas):
+    from .models import TurnoutCounter
+    term = current_term()
+    if district_id is None or term is None:
+        return
+    changes = {field: F(field) + delta for field, delta in deltas.items()}
+    counters = TurnoutCounter.objects.filter(district_id=district_id, term=term)
+    if counters.update(updated_at=timezone.now(), **changes):
+        return
+    try:
+        with transaction.atomic(using=router.db_for_write(TurnoutCounter)):
+            TurnoutCounter.objects.create(district_id=district_id, term=term, **deltas)
+    except IntegrityError:
+        # Created concurrently by another worker
+        counters.update(updated_at=timezone.now(), **changes)
+
+
+def record_registration(district_id):
+    _add(district_id, eligible=1)
+
+
+def record_unregistration(district_id, voted):
+    _add(district_id, eligible=-1, voted=-1 if voted else 0)
+
+
+def record_vote(district_id):
+    _add(district_id, voted=1)
+
+
+def count_turnout(alias):
+    from .models import User
+    rows = User.objects.using(alias).filter(is_staff=False, is_active=True).values('district_id').annotate(
+        eligible=Count('pk'),
+        voted=Count('pk', filter=Q(voted=True)),
+    )
+    return {row['district_id']: (row['eligible'], row['voted']) for row in rows}
+
+
+def reconcile_turnout(term=None):
+    """Recounts every district from the user tables of all shards and rewrites the counters."""
+    from .models import TurnoutCounter
+    term = term or current_term()
+    if term is None:
+        return []
+    eligible, voted = Counter(), Counter()
+    for counts in scatter_gather(count_turnout):
+        for district_id, (district_eligible, district_voted) in counts.items():
+            if district_id is not None:
+                eligible[district_id] += district_eligible
+                voted[district_id] += district_voted
+    counters = []
+    for district_id in eligible:
+        counter, _ = TurnoutCounter.objects.update_or_create(
+            district_id=district_id,
+            term=term,
+            defaults={'eligible': eligible[district_id], 'voted': voted[district_id]},
+        )
+        counters.append(counter)
+    TurnoutCounter.objects.filter(term=term).exclude(district_id__in=list(eligible)).delete()
+    return counters
+
+
+def turnout_for(user):
+    from .models import TurnoutCounter
+    counters = TurnoutCounter.objects.filter(term=current_term()).select_related('district', 'term')
+    if not user.is_superuser:
+        counters = counters.filter(district_id=user.district_id)
+    return counters.order_by('district__short_name')
@@ -0,0 +1,136 @@
+import datetime
+from collections import defaultdict
+
+from django.utils import timezone
+
+from .models import District, User
+from .sharding import is_sharded, scatter_gather
+
+ROLL_FIELDS = ('id', 'name', 'email', 'district', 'birthdate', 'address')
+MIN_VOTER_AGE = 18
+# The only format UserResource's birthdate widget accepts, so both read the same date
+BIRTHDATE_FORMAT = '%Y-%m-%d'
+# SQL Server accepts at most 2100 parameters per statement
+MAX_IN_PARAMS = 2000
+
+
+def is_blank(value):
+    return value is None or str(value).strip() in ('', 'None')
+
+
+def normalize_key(value):
+    # Spreadsheet cells holding ids often come back as floats, e.g. 12.0
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+
+def registered_ids(ids, using=None):
+    """Returns which of ``ids`` already belong to a user, on ``using`` or on every shard."""
+    ids = list(ids)
+
+    def find(alias):
+        found = set()
+        for i in range(0, len(ids), MAX_IN_PARAMS):
+            found.update(User.objects.using(alias).filter(pk__in=ids[i:i + MAX_IN_PARAMS]).values_list('id', flat=True))
+        return found
+
+    if using is None and is_sharded():
+        return set().union(*scatter_gather(find))
+    return find(using)
+
+
+def parse_date(value):
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, datetime.date):
+        return value
+    try:
+        return datetime.datetime.strptime(str(value), BIRTHDATE_FORMAT).date()
+    except ValueError:
+        return None
+
+
+def latest_eligible_birthdate(today):
+    try:
+        return today.replace(year=today.year - MIN_VOTER_AGE)
+    except ValueError:
+        # 29 February
+        return today.replace(year=today.year - MIN_VOTER_AGE, day=28)
+
+
+class RollReport:
+    """Errors found in a voter roll, grouped by 1-based row number and field."""
+
+    def __init__(self, total_rows=0):
+        self.total_rows = total_rows
+        self.row_errors = defaultdict(lambda: defaultdict(list))
+        self.file_errors = []
+
+    def add(self, row_number, field, message):
+        self.row_errors[row_number][field].append(message)
+
+    @property
+    def has_errors(self):
+        return bool(self.file_errors or self.row_errors)
+
+    def errors_for(self, row_number):
+        return {field: messages for field, messages in self.row_errors.get(row_number, {}).items()}
+
+    def lines(self):
+        yield from self.file_errors
+        for row_number in sorted(self.row_errors):
+            for field, messages in self.row_errors[row_number].items():
+                for message in messages:
+                    yield f"Row {row_number}, {field}: {message}"
+
+
+def validate_voter_roll(dataset, today=None, using=None):
+    """Checks a whole ``tablib.Dataset`` column by column before anything is imported.
+
+    Existing ids are fetched with a single query (one per shard) and compared
+    as a set, so the cost does not grow with one database round trip per row.
+    """
+    report = RollReport(len(dataset))
+    missing = [field for field in ROLL_FIELDS if field not in (dataset.headers or [])]
+    if missing:
+        report.file_errors.append(f"Missing columns: {', '.join(missing)}")
+        return report
+
+    columns = {field: dataset[field] for field in ROLL_FIELDS}
+    for field, column in columns.items():
+        for row_number, value in enumerate(column, 1):
+            if is_blank(value):
+                report.add(row_number, field, 'This field is required.')
+
+    cutoff = latest_eligible_birthdate(today or timezone.localdate())
+    for row_number, value in enumerate(columns['birthdate'], 1):
+        if is_blank(value):
+            continue
+        birthdate = parse_date(value)
+        if birthdate is None:
+            report.add(row_number, 'birthdate', f"Invalid date: {value}, expected YYYY-MM-DD.")
+        elif birthdate > cutoff:
+            report.add(row_number, 'birthdate', f"Voter must be at least {MIN_VOTER_AGE} years old.")
+
+    districts = {str(pk) for pk in District.objects.using(using).values_list('pk', flat=True)}
+    for row_number, value in enumerate(columns['district'], 1):
+        if not is_blank(value) and normalize_key(value) not in districts:
+            report.add(row_number, 'district', f"Unknown district: {value}")
+
+    first_seen = {}
+    for row_number, value in enumerate(columns['id'], 1):
+        if is_blank(value):
+            continue
+        id = normalize_key(value)
+        if len(id) < 3:
+            report.add(row_number, 'id', 'ID must be at least 3 characters long')
+        if id in first_seen:
+            report.add(row_number, 'id', f"Duplicate of row {first_seen[id]}.")
+        else:
+            first_seen[id] = row_number
+
+    for id in registered_ids(first_seen, using):
+        report.add(first_seen[id], 'id', f"Voter {id} is already registered.")
+
+    return report
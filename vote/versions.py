@@ -0,0 +1,50 @@
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+# Versions are random tokens rather than counters: a flushed or evicted key
+# can never come back with a value a client has already seen.
+def _cache():
+    return caches[getattr(settings, 'VOTE_VERSION_CACHE', 'default')]
+
+
+def _new_version():
+    return uuid.uuid4().hex[:12]
+
+
+def get_version(name):
+    cache = _cache()
+    key = f"vote:version:{name}"
+    version = cache.get(key)
+    if version is None:
+        version = _new_version()
+        if not cache.add(key, version, timeout=None):
+            version = cache.get(key, version)
+    return version
+
+
+def bump_version(name):
+    _cache().set(f"vote:version:{name}", _new_version(), timeout=None)
+
+
+def candidates_version(district_id=None):
+    if district_id is None:
+        return get_version('candidates')
+    return get_version(f"candidates:{district_id}")
+
+
+def bump_candidates_version(*district_ids):
+    bump_version('candidates')
+    for district_id in district_ids:
+        if district_id is not None:
+            bump_version(f"candidates:{district_id}")
+
+
+def ballot_version(user_id):
+    return get_version(f"ballot:{user_id}")
+
+
+def bump_ballot_version(user_id):
+    bump_version(f"ballot:{user_id}")
@@ -1,3 +1,5 @@
+import hashlib
+
 from django.core.exceptions import ValidationError
 from django.shortcuts import render
 from django.contrib import messages
@@ -6,10 +8,15 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.urls import reverse
 from django.utils.http import urlencode
 from django.http import JsonResponse
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
 
 
 from .models import User, Candidate, Vote
 from .forms import LoginForm, RegisterForm, ChangePasswordForm
+from .preload import candidates_in_district
+from .sharding import user_exists
+from .versions import ballot_version, candidates_version
 
 
 def check_authentication(f):
@@ -26,17 +33,43 @@ def check_authentication(f):
     return wrapper
 
 
+def make_etag(request, *parts):
+    user = request.user
+    # Pending flash messages are rendered once, so such pages are never revalidated
+    if not user.is_authenticated or user.is_staff or len(messages.get_messages(request)):
+        return None
+    # The page embeds the CSRF token, which changes when the cookie does
+    parts = (user.id, user.name, request.META.get('CSRF_COOKIE', '')) + parts
+    return hashlib.sha256('|'.join(map(str, parts)).encode()).hexdigest()
+
+
+def index_etag(request):
+    user = request.user
+    if not user.is_authenticated:
+        return None
+    return make_etag(request, user.district_id, user.voted,
+                     candidates_version(user.district_id), ballot_version(user.id))
+
+
+def candidate_detail_etag(request, candidate_id):
+    return make_etag(request, candidate_id, candidates_version())
+
+
 @check_authentication
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=index_etag)
 def index(request):
     if request.user.is_staff:
         return redirect('admin:index')
 
-    candidates = Candidate.objects.filter(district=request.user.district)
+    # Card markup is cached per candidate under the district's version, bumped on Candidate changes
+    candidates = candidates_in_district(request.user.district_id)
     voted = request.user.get_voted()
     change_password_form = ChangePasswordForm()
 
     return render(request, 'vote/index.html', context={
         'candidates': candidates,
+        'candidates_version': candidates_version(request.user.district_id),
         'voted': voted,
         'change_password_form': change_password_form,
     })
@@ -110,7 +143,7 @@ def register(request):
             email = register_form.cleaned_data['email']
             if password != password_confirm:
                 return redirect('vote:register')
-            if User.objects.filter(id=id).exists():
+            if user_exists(id):
                 return redirect('vote:register')
             user = User.objects.create_user(
                 id=id,
@@ -130,11 +163,13 @@ def register(request):
     })
 
 
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=candidate_detail_etag)
 def candidate_detail(request, candidate_id):
     if not request.user.is_authenticated:
         return redirect('vote:index')
 
-    c = get_object_or_404(Candidate, id=candidate_id)
+    c = get_object_or_404(Candidate.objects.on_shard_of(request.user.district_id), id=candidate_id)
 
     return render(request, 'vote/candidate_detail.html', context={
         'candidate': c,
@@ -145,7 +180,9 @@ def vote(request, candidate_id):
     if not request.user.is_authenticated:
         return redirect('vote:index')
 
-    c = get_object_or_404(Candidate, id=candidate_id)
+    # The vote and the voter's flag are written on one shard, so only candidates
+    # of the voter's district can be chosen
+    c = get_object_or_404(Candidate.objects.in_district(request.user.district_id), id=candidate_id)
 
     if request.method == 'POST':
         v = Vote.objects.create(